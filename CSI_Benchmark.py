@@ -0,0 +1,264 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import CSI_Log_Generator
+import CSI_Log_Reader
+import CSI_Options
+import CSI_Python_Parser
+import data_compile
+
+
+DEFAULT_PACKETS = 20000
+REFERENCE_PACKETS = 2000  # record_CSI_data is slow, it only decodes this many packets
+DEFAULT_THRESHOLD = 0.1  # fraction a stage may get slower or bigger than the baseline before it counts as a regression
+
+
+def csi_buffers(log_file, limit=None):
+    """
+    CSI of the packets of a log, copied out so the stages don't share the reader's map
+    :param log_file: path of the log
+    :param limit: most packets to return, None for all of them
+    :return: (list of csi bytes, list of (nr, nc, num_tones))
+    """
+    buffs = []
+    shapes = []
+    with CSI_Log_Reader.CSILogReader(log_file) as reader:
+        for offset, meta_data, csi_view in reader.records():
+            if meta_data[1] > 0:
+                buffs.append(bytes(csi_view))
+                shapes.append((meta_data[8], meta_data[9], meta_data[7]))
+                if limit is not None and len(buffs) == limit:
+                    break
+    return buffs, shapes
+
+
+def compile_stage(mode, output):
+    """
+    Stage that runs one of the parse_and_data_compile functions
+    :param mode: compile mode 1 to 4
+    :param output: output csv
+    :return: stage function
+    """
+    compile_function = {
+        '1': data_compile.parse_and_data_compile_mag,
+        '2': data_compile.parse_and_data_compile_other,
+        '3': data_compile.parse_and_data_compile_append,
+        '4': data_compile.parse_and_data_compile_other_append,
+    }[mode]
+
+    def stage(bench):
+        # the append modes would resume from their checkpoint and compile nothing the second time
+        for stale in (output, data_compile.checkpoint_file_name(output)):
+            if os.path.exists(stale):
+                os.remove(stale)
+        compile_function(bench["log"], bench["groupings"], bench["bob"], bench["eve"], output)
+        return bench["packets"]
+    return stage
+
+
+def decode_reference(bench):
+    for buff, (nr, nc, num_tones) in zip(bench["reference_buffs"], bench["reference_shapes"]):
+        CSI_Python_Parser.record_CSI_data(buff, nr, nc, num_tones, True)
+    return len(bench["reference_buffs"])
+
+
+def decode_batch(bench):
+    CSI_Python_Parser.decode_CSI_batch(bench["buffs"], bench["shapes"], True)
+    return len(bench["buffs"])
+
+
+def parse_objects(bench):
+    return len(data_compile.parse_info(bench["log"]))
+
+
+def parse_lazy(bench):
+    return len(data_compile.parse_info(bench["log"], lazy=True))
+
+
+def parse_columnar(bench):
+    return len(data_compile.parse_info(bench["log"], columnar=True))
+
+
+def labels_per_packet(bench):
+    bob, eve = data_compile.process_bob_eve(bench["bob"], bench["eve"])
+    for seq_num in range(1, bench["packets"] + 1):
+        data_compile.bobVsEve(bob, eve, seq_num)
+    return bench["packets"]
+
+
+def labels_vectorized(bench):
+    bob, eve = data_compile.process_bob_eve(bench["bob"], bench["eve"])
+    data_compile.victory_labels(bob, eve, np.arange(1, bench["packets"] + 1))
+    return bench["packets"]
+
+
+def make_stages(work_dir):
+    """
+    Every stage of the suite in the order they run
+    :param work_dir: directory for the outputs of the compile stages
+    :return: dict of stage name to a function that takes the bench dict and returns the packets it processed
+    """
+    stages = {
+        "record_CSI_data": decode_reference,
+        "decode_CSI_batch": decode_batch,
+        "parse_info": parse_objects,
+        "parse_info_lazy": parse_lazy,
+        "parse_info_columnar": parse_columnar,
+        "bobVsEve": labels_per_packet,
+        "victory_labels": labels_vectorized,
+    }
+    for mode in "1234":
+        stages["compile_mode" + mode] = compile_stage(mode, os.path.join(work_dir, "mode" + mode + ".csv"))
+    return stages
+
+
+def run_stage(stage, bench, repeat):
+    """
+    Time a stage, then run it once more under tracemalloc for its peak memory
+    :param stage: stage function
+    :param bench: bench dict
+    :param repeat: timed runs, the fastest counts
+    :return: (packets processed, fastest seconds, peak traced memory in bytes)
+    """
+    seconds = None
+    with contextlib.redirect_stdout(io.StringIO()):  # the compile functions report every run
+        for i in range(repeat):
+            start = time.perf_counter()
+            packets = stage(bench)
+            elapsed = time.perf_counter() - start
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+        tracemalloc.start()
+        stage(bench)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return packets, seconds, peak
+
+
+def run_suite(bench, stages, repeat):
+    """
+    Run the stages
+    :param bench: bench dict with the log, its csvs and its packet count
+    :param stages: dict from make_stages, possibly a subset
+    :param repeat: timed runs per stage
+    :return: dict of stage name to its results
+    """
+    bytes_per_packet = bench["log_size"] / max(bench["packets"], 1)
+    results = {}
+    for name, stage in stages.items():
+        packets, seconds, peak = run_stage(stage, bench, repeat)
+        seconds = max(seconds, 1e-9)
+        results[name] = {
+            "packets": packets,
+            "seconds": seconds,
+            "packets_per_second": packets / seconds,
+            "mb_per_second": packets * bytes_per_packet / 1e6 / seconds,
+            "peak_memory_mb": peak / 1e6,
+        }
+        print("%-22s %10d packets %9.3f s %12.0f packets/s %9.2f MB/s %9.1f MB peak"
+              % (name, packets, seconds, packets / seconds, results[name]["mb_per_second"], peak / 1e6))
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compare results against a stored run, only the stages both have are compared
+    :param results: dict from run_suite
+    :param baseline: dict from run_suite of an earlier run
+    :param threshold: allowed fraction of slowdown or memory growth
+    :return: list of messages, one per regression
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result["packets_per_second"] < base["packets_per_second"] * (1 - threshold):
+            regressions.append("%s: %.0f packets/s, baseline %.0f"
+                               % (name, result["packets_per_second"], base["packets_per_second"]))
+        if result["peak_memory_mb"] > base["peak_memory_mb"] * (1 + threshold):
+            regressions.append("%s: %.1f MB peak, baseline %.1f"
+                               % (name, result["peak_memory_mb"], base["peak_memory_mb"]))
+    return regressions
+
+
+def main():
+    args, options = CSI_Options.parse_options(sys.argv[1:], {
+        "packets": int, "size-mb": float, "nr": int, "nc": int, "tones": int, "payload": int, "seed": int,
+        "stages": str, "repeat": int, "reference-packets": int, "work-dir": str, "output": str,
+        "baseline": str, "threshold": float,
+    })
+    if options is None or args:
+        print("python CSI_Benchmark.py [--packets N | --size-mb MB] [--nr 2] [--nc 2] [--tones 56] [--payload 766] "
+              "[--stages a,b] [--repeat 3] [--output results.json] [--baseline results.json [--threshold 0.1]]")
+        return
+
+    nr, nc, num_tones = options.get("nr", 2), options.get("nc", 2), options.get("tones", 56)
+    payload_size = options.get("payload", CSI_Python_Parser.PING_PAYLOAD_SIZE)
+    record_len = (CSI_Log_Reader.RECORD_HEADER_LEN + 2 * CSI_Python_Parser.csi_word_count(nr, nc, num_tones)
+                  + payload_size)
+    num_packets = options.get("packets", DEFAULT_PACKETS)
+    if "size-mb" in options:
+        num_packets = max(1, int(options["size-mb"] * 1e6 / record_len))
+
+    work_dir = options.get("work-dir", "benchmark")
+    os.makedirs(work_dir, exist_ok=True)
+    stages = make_stages(work_dir)
+    if "stages" in options:
+        names = options["stages"].split(",")
+        unknown = [name for name in names if name not in stages]
+        if unknown:
+            print("Unknown stages:", ",".join(unknown), "pick from", ",".join(stages))
+            return
+        stages = {name: stages[name] for name in names}
+
+    log_file = os.path.join(work_dir, "synthetic.dat")
+    print("Writing", num_packets, "packets to", log_file)
+    bob_csv, eve_csv = log_file + ".bob.csv", log_file + ".eve.csv"
+    CSI_Log_Generator.generate_log(log_file, num_packets, nr, nc, num_tones, payload_size, seed=options.get("seed", 0))
+    CSI_Log_Generator.generate_seq_csvs(num_packets, bob_csv, eve_csv, seed=options.get("seed", 0) + 1)
+
+    # the legacy cut-off drops the last packets of a log, count what the stages actually see
+    buffs, shapes = csi_buffers(log_file)
+    num_reference = options.get("reference-packets", REFERENCE_PACKETS)
+    bench = {
+        "log": log_file, "bob": bob_csv, "eve": eve_csv, "groupings": nr * nc, "packets": len(buffs),
+        "log_size": os.path.getsize(log_file), "buffs": buffs, "shapes": shapes,
+        "reference_buffs": buffs[:num_reference], "reference_shapes": shapes[:num_reference],
+    }
+    config = {
+        "packets": len(buffs), "log_bytes": bench["log_size"], "nr": nr, "nc": nc, "num_tones": num_tones,
+        "payload_size": payload_size, "repeat": options.get("repeat", 3),
+        "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+    }
+
+    results = run_suite(bench, stages, config["repeat"])
+    if "output" in options:
+        with open(options["output"], "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+
+    if "baseline" in options:
+        try:
+            with open(options["baseline"], "r") as f:
+                baseline = json.load(f)["results"]
+        except (IOError, ValueError, KeyError):
+            print("Couldn't read baseline file!")
+            sys.exit(2)
+        regressions = find_regressions(results, baseline, options.get("threshold", DEFAULT_THRESHOLD))
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", options["baseline"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+
+import numpy as np
+
+import CSI_Class
+
+
+CACHE_VERSION = 1  # bump when the layout of an entry changes
+HEADER_HASH_BYTES = 1 << 16  # bytes at the start of a log that go into its key
+DEFAULT_SIZE_LIMIT = 10 * (1 << 30)  # bytes
+
+
+def cache_key(log_file):
+    """
+    Key of a log in the cache, from its path, size, mtime and a hash of its first bytes
+    :param log_file: path of the CSI log
+    :return: hex digest
+    """
+    stat = os.stat(log_file)
+    digest = hashlib.sha1()
+    digest.update(os.path.abspath(log_file).encode("utf-8"))
+    digest.update(struct.pack("<QqI", stat.st_size, stat.st_mtime_ns, CACHE_VERSION))
+    with open(log_file, "rb") as f:
+        digest.update(f.read(HEADER_HASH_BYTES))
+    return digest.hexdigest()
+
+
+def csi_to_pairs(data):
+    """
+    Pack complex csi into int16 (real, imag) pairs, exact because the csi values are BIT_RESOLUTION bit integers
+    :param data: complex numpy array of shape (packets, streams, tones)
+    :return: int16 numpy array of shape (packets, streams * tones * 2)
+    """
+    return np.stack([data.real, data.imag], axis=-1).astype(np.int16).reshape(len(data), -1)
+
+
+def pairs_to_csi(pairs, num_streams, num_tones):
+    """
+    Inverse of csi_to_pairs
+    :param pairs: int16 numpy array of shape (packets, streams * tones * 2)
+    :param num_streams: number of streams (nr * nc)
+    :param num_tones: number of sub-carriers
+    :return: complex numpy array of shape (packets, streams, tones)
+    """
+    pairs = np.asarray(pairs).reshape(len(pairs), num_streams, num_tones, 2)
+    data = np.empty(pairs.shape[:-1], dtype=complex)
+    data.real = pairs[..., 0]
+    data.imag = pairs[..., 1]
+    return data
+
+
+class CSICache:
+    """
+    On-disk cache of the decoded CSI of whole logs, evicted least recently used first once over its size limit.
+    Every log gets a directory named after cache_key holding memory-mappable arrays and an info.json.
+    Attributes:
+        cache_dir   (str):  directory of the cache
+        size_limit  (int):  most bytes the cache may hold
+    """
+
+    def __init__(self, cache_dir, size_limit=DEFAULT_SIZE_LIMIT):
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self, log_file):
+        """
+        Look up a log in the cache
+        :param log_file: path of the CSI log
+        :return: CachedLog, or None on a miss
+        """
+        entry_dir = os.path.join(self.cache_dir, cache_key(log_file))
+        info_file = os.path.join(entry_dir, "info.json")
+        try:
+            with open(info_file, "r") as f:
+                info = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if info.get("version") != CACHE_VERSION:
+            return None
+        os.utime(info_file)  # the mtime of info.json is the last use for LRU eviction
+        return CachedLog(entry_dir, info)
+
+    def writer(self, log_file):
+        """
+        Start a new entry for a log, it becomes visible once committed
+        :param log_file: path of the CSI log
+        :return: CacheWriter
+        """
+        return CacheWriter(self, log_file, cache_key(log_file))
+
+    def entries(self):
+        """
+        Committed entries of the cache
+        :return: list of (last use time, size in bytes, entry directory)
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            info_file = os.path.join(entry_dir, "info.json")
+            if name.endswith(".tmp") or not os.path.isfile(info_file):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(info_file), size, entry_dir))
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache fits its size limit
+        :param keep: entry directory that is never removed, e.g. the one just written
+        :return:
+        """
+        entries = sorted(self.entries())
+        total = sum(size for last_use, size, entry_dir in entries)
+        for last_use, size, entry_dir in entries:
+            if total <= self.size_limit:
+                break
+            if entry_dir == keep:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+
+class CacheWriter:
+    """
+    Streams decoded chunks of a log into a new cache entry.
+    """
+
+    def __init__(self, cache, log_file, key):
+        self.cache = cache
+        self.log_file = log_file
+        self.entry_dir = os.path.join(cache.cache_dir, key)
+        self.tmp_dir = self.entry_dir + "." + str(os.getpid()) + ".tmp"
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.meta_file = open(os.path.join(self.tmp_dir, "meta.bin"), "wb")
+        self.packet_num_file = open(os.path.join(self.tmp_dir, "packet_nums.bin"), "wb")
+        self.group_files = {}  # (nr, nc, num_tones) to (rows file, csi file, row count)
+        self.num_packets = 0
+
+    def add(self, packet_nums, meta, groups):
+        """
+        Append a chunk
+        :param packet_nums: numpy array of packet numbers
+        :param meta: structured array of CSI_Class.META_DTYPE
+        :param groups: dict of (nr, nc, num_tones) to (rows into the chunk, complex array (packets, nr * nc, num_tones))
+        :return:
+        """
+        for shape, (rows, data) in groups.items():
+            if shape not in self.group_files:
+                name = "group_%d_%d_%d" % shape
+                self.group_files[shape] = [
+                    open(os.path.join(self.tmp_dir, name + ".rows"), "wb"),
+                    open(os.path.join(self.tmp_dir, name + ".csi"), "wb"),
+                    0,
+                ]
+            group = self.group_files[shape]
+            group[0].write((np.asarray(rows, dtype=np.int64) + self.num_packets).tobytes())
+            group[1].write(csi_to_pairs(data).tobytes())
+            group[2] += len(rows)
+        self.meta_file.write(np.asarray(meta, dtype=CSI_Class.META_DTYPE).tobytes())
+        self.packet_num_file.write(np.asarray(packet_nums, dtype=np.int64).tobytes())
+        self.num_packets += len(packet_nums)
+
+    def close_files(self):
+        self.meta_file.close()
+        self.packet_num_file.close()
+        for rows_file, csi_file, num_rows in self.group_files.values():
+            rows_file.close()
+            csi_file.close()
+
+    def commit(self):
+        """
+        Finish the entry, make it visible and evict old entries if the cache grew past its limit
+        :return:
+        """
+        self.close_files()
+        info = {
+            "version": CACHE_VERSION,
+            "log": os.path.abspath(self.log_file),
+            "packets": self.num_packets,
+            "groups": [
+                {"shape": list(shape), "rows": num_rows, "file": "group_%d_%d_%d" % shape}
+                for shape, (rows_file, csi_file, num_rows) in self.group_files.items()
+            ],
+        }
+        with open(os.path.join(self.tmp_dir, "info.json"), "w") as f:
+            json.dump(info, f, indent=2)
+
+        shutil.rmtree(self.entry_dir, ignore_errors=True)
+        os.replace(self.tmp_dir, self.entry_dir)
+        self.cache.evict(keep=self.entry_dir)
+
+    def abort(self):
+        self.close_files()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class CachedLog:
+    """
+    A committed cache entry, its arrays are memory mapped.
+    Attributes:
+        packet_nums (numpy array):  packet number of every cached packet
+        meta        (numpy array):  structured array of CSI_Class.META_DTYPE, one row per packet
+        groups      (dict):         (nr, nc, num_tones) to (packet rows, int16 csi pairs)
+    """
+
+    def __init__(self, entry_dir, info):
+        num_packets = info["packets"]
+        self.packet_nums = map_array(os.path.join(entry_dir, "packet_nums.bin"), np.int64, (num_packets,))
+        self.meta = map_array(os.path.join(entry_dir, "meta.bin"), CSI_Class.META_DTYPE, (num_packets,))
+        self.groups = {}
+        for group in info["groups"]:
+            shape = tuple(group["shape"])
+            base = os.path.join(entry_dir, group["file"])
+            rows = map_array(base + ".rows", np.int64, (group["rows"],))
+            pairs = map_array(base + ".csi", np.int16, (group["rows"], shape[0] * shape[1] * shape[2] * 2))
+            self.groups[shape] = (rows, pairs)
+
+    def __len__(self):
+        return len(self.packet_nums)
+
+    def chunks(self, chunk_size):
+        """
+        Read the cached packets back in chunks like they were decoded
+        :param chunk_size: number of packets per chunk
+        :return: generator of (packet_nums, meta, groups) in the layout CacheWriter.add takes
+        """
+        for start in range(0, len(self.packet_nums), chunk_size):
+            stop = min(start + chunk_size, len(self.packet_nums))
+            groups = {}
+            for shape, (rows, pairs) in self.groups.items():
+                first, last = np.searchsorted(rows, [start, stop])
+                if first < last:
+                    nr, nc, num_tones = shape
+                    groups[shape] = (np.asarray(rows[first:last]) - start, pairs_to_csi(pairs[first:last], nr * nc, num_tones))
+            yield np.asarray(self.packet_nums[start:stop]), np.asarray(self.meta[start:stop]), groups
+
+
+def map_array(file_name, dtype, shape):
+    """
+    Memory map a cache file, empty arrays can't be mapped
+    :param file_name: path of the file
+    :param dtype: type of the values
+    :param shape: shape of the array
+    :return: numpy memmap or empty array
+    """
+    if shape[0] == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(file_name, dtype=dtype, mode="r", shape=shape)
@@ -0,0 +1,203 @@
+import json
+import os
+import sys
+import time
+
+
+HISTOGRAM_BUCKETS = 40  # power of two buckets, the last one holds everything from 2^38 ns (about 4.6 minutes) up
+PPS_WINDOW = 10  # seconds of the sliding packets per second window
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations in power of two nanosecond buckets, recording one costs a bit_length and an increment.
+    Bucket b holds durations d with 2^(b-1) <= d < 2^b, bucket 0 holds zero.
+    Attributes:
+        counts  (list): count of every bucket
+        count   (int):  durations recorded
+        total   (int):  sum of the durations in ns
+        max     (int):  longest duration in ns
+    """
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, duration_ns):
+        """
+        Add one duration
+        :param duration_ns: duration in nanoseconds
+        :return:
+        """
+        bucket = duration_ns.bit_length()
+        if bucket >= HISTOGRAM_BUCKETS:
+            bucket = HISTOGRAM_BUCKETS - 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += duration_ns
+        if duration_ns > self.max:
+            self.max = duration_ns
+
+    def percentile(self, fraction):
+        """
+        Upper bound of the bucket a percentile falls in
+        :param fraction: percentile as a fraction, e.g. 0.99
+        :return: duration in ns, 0 if nothing was recorded
+        """
+        if self.count == 0:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(1 << bucket, self.max) if bucket else 0
+        return self.max
+
+    def to_dict(self):
+        """
+        Summary of the histogram
+        :return: dict with count, mean, p50, p90, p99, max in ns and the non empty buckets keyed by upper bound
+        """
+        return {
+            "count": self.count,
+            "mean_ns": self.total // self.count if self.count else 0,
+            "p50_ns": self.percentile(0.5),
+            "p90_ns": self.percentile(0.9),
+            "p99_ns": self.percentile(0.99),
+            "max_ns": self.max,
+            "buckets": {str(1 << bucket if bucket else 0): count for bucket, count in enumerate(self.counts) if count},
+        }
+
+
+class RateWindow:
+    """
+    Events per second over a sliding window of whole seconds, kept in a small ring of per second counters.
+    """
+
+    def __init__(self, window=PPS_WINDOW):
+        self.window = window
+        self.seconds = [-1] * window  # second every slot counts for
+        self.counts = [0] * window
+
+    def add(self, now_ns):
+        """
+        Count one event
+        :param now_ns: time.perf_counter_ns() of the event
+        :return:
+        """
+        second = now_ns // 1000000000
+        slot = second % self.window
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+
+    def rate(self, now_ns):
+        """
+        Events per second over the last full seconds of the window
+        :param now_ns: time.perf_counter_ns() now
+        :return: events per second
+        """
+        second = now_ns // 1000000000
+        first = second - self.window + 1
+        total = sum(count for slot_second, count in zip(self.seconds, self.counts) if first <= slot_second < second)
+        return total / (self.window - 1)
+
+
+class CaptureStats:
+    """
+    Instrumentation of the capture loop, cheap enough to stay on: every sample is a perf_counter_ns
+    difference the loop already has and a few integer updates.
+    Attributes:
+        started_ns          (int):              time.perf_counter_ns() when the capture started
+        empty_reads         (int):              device reads that returned no data
+        productive_reads    (int):              device reads that returned a record
+        packets_sent        (int):              replies sent
+        read_latency        (LatencyHistogram): duration of every device read
+        read_to_send        (LatencyHistogram): from the end of the read to the reply being sent
+        log_latency         (LatencyHistogram): time the capture loop spends handing a record to the log writer
+        log_write           (LatencyHistogram): time the log writer thread spends in every write to storage
+        send_rate           (RateWindow):       replies per second over the sliding window
+    """
+
+    def __init__(self):
+        self.started_ns = time.perf_counter_ns()
+        self.empty_reads = 0
+        self.productive_reads = 0
+        self.packets_sent = 0
+        self.read_latency = LatencyHistogram()
+        self.read_to_send = LatencyHistogram()
+        self.log_latency = LatencyHistogram()
+        self.log_write = LatencyHistogram()
+        self.send_rate = RateWindow()
+
+    def read(self, start_ns, end_ns, cnt):
+        """
+        Record one device read
+        :param start_ns: perf_counter_ns before the read
+        :param end_ns: perf_counter_ns after the read
+        :param cnt: bytes read
+        :return:
+        """
+        self.read_latency.record(end_ns - start_ns)
+        if cnt > 0:
+            self.productive_reads += 1
+        else:
+            self.empty_reads += 1
+
+    def sent(self, read_end_ns, sent_ns):
+        """
+        Record one reply
+        :param read_end_ns: perf_counter_ns after the read of the packet that was answered
+        :param sent_ns: perf_counter_ns after sendto returned
+        :return:
+        """
+        self.packets_sent += 1
+        self.read_to_send.record(sent_ns - read_end_ns)
+        self.send_rate.add(sent_ns)
+
+    def to_dict(self):
+        """
+        All stats in a JSON friendly form
+        :return: dict
+        """
+        now_ns = time.perf_counter_ns()
+        return {
+            "time": time.time(),
+            "uptime_s": (now_ns - self.started_ns) / 1e9,
+            "cpu_s": time.process_time(),
+            "empty_reads": self.empty_reads,
+            "productive_reads": self.productive_reads,
+            "packets_sent": self.packets_sent,
+            "packets_per_second": self.send_rate.rate(now_ns),
+            "pps_window_s": self.send_rate.window - 1,
+            "read_latency": self.read_latency.to_dict(),
+            "read_to_send": self.read_to_send.to_dict(),
+            "log_latency": self.log_latency.to_dict(),
+            "log_write": self.log_write.to_dict(),
+        }
+
+    def dump(self, out=None):
+        """
+        Print the stats as JSON
+        :param out: text file to print to, stdout by default
+        :return:
+        """
+        out = out or sys.stdout
+        json.dump(self.to_dict(), out, indent=2)
+        out.write("\n")
+        out.flush()
+
+    def write_file(self, stats_file):
+        """
+        Replace a stats file with the current stats, readers never see a half written file
+        :param stats_file: path of the stats file
+        :return:
+        """
+        tmp_file = stats_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_file, stats_file)
@@ -1,67 +1,214 @@
-class CSI:
-    """
-    This is a class to hold information from the kernel about the CSI information of the received network packet.
-    Attributes:
-        buf_len     (int):  length of the buffer in bytes.
-        tsf_stamp   (int): time (TSF) of when the packet arrived in microseconds.
-        csi_len     (int): length of the portion of the buffer in bytes.
-        channel     (int): center frequency of the wireless channel in MHz.
-        payload_len (int): length of the payload in the received packet in bytes.
-        phyerr      (int): phy error code, 0 if packet received successfully.
-        noise       (int): noise floor expressed in dB.
-        rate        (int): data rate of the received packet
-        chan_bw     (int): channel bandwidth =0 if 20MHz and =1 if 40MHz.
-        num_tones   (int): number of sub-carriers that was used in transmission.
-        nr          (int): number of receiving antennae
-        nc          (int): number of transmitting antennae
-        rssi        (int): rssi of combination of all the active chains.
-        rssi_0      (int): rssi of active chain 0
-        rssi_1      (int): rssi of active chain 1
-        rssi_2      (int): rssi of active chain 2
-        data        (list of numpy arrays): csi data of the received packet, each array has num_tone complex pairs
-    """
-
-    def __init__(self):
-        """
-        The constructor for the CSI class
-        Set each individual thing, avoided having lengthy constructor call
-        """
-        self.buf_len = 0
-        self.tfs_stamp = 0
-        self.csi_len = 0
-        self.channel = 0
-        self.payload_len = 0
-        self.phyerr = 0
-        self.noise = 0
-        self.rate = 0
-        self.chan_bw = 0
-        self.num_tones = 0
-        self.nr = 0
-        self.nc = 0
-        self.rssi = 0
-        self.rssi_0 = 0
-        self.rssi_1 = 0
-        self.rssi_2 = 0
-        self.data = []
-
-    def print_status(self):
-        """
-        Prints to the terminal the meta data for the received packet
-        :return:
-        """
-        print("Status Report")
-        print("csi_len is:      ", self.csi_len)
-        print("Channel is:      ", self.channel)
-        print("err_info is:     ", self.phyerr)
-        print("noise_floor is:  ", self.noise)
-        print("Rate is:         ", self.rate)
-        print("bandWidth is:    ", self.chan_bw)
-        print("num_tones is:    ", self.num_tones)
-        print("nr is:           ", self.nr)
-        print("nc is:           ", self.nc)
-        print("rssi is:         ", self.rssi)
-        print("rssi1 is:        ", self.rssi_0)
-        print("rssi2 is:        ", self.rssi_1)
-        print("rssi3 is:        ", self.rssi_2)
-        print("payload_len is:  ", self.payload_len)
-        print("")
\ No newline at end of file
+import numpy as np
+
+
+# metadata of one packet per row, same fields as the CSI class in the order of the status header
+META_DTYPE = np.dtype(
+    [
+        ("buf_len", "=u2"),
+        ("tfs_stamp", "=u8"),
+        ("csi_len", "=u2"),
+        ("channel", "=u2"),
+        ("phyerr", "u1"),
+        ("noise", "u1"),
+        ("rate", "u1"),
+        ("chan_bw", "u1"),
+        ("num_tones", "u1"),
+        ("nr", "u1"),
+        ("nc", "u1"),
+        ("rssi", "u1"),
+        ("rssi_0", "u1"),
+        ("rssi_1", "u1"),
+        ("rssi_2", "u1"),
+        ("payload_len", "=u2"),
+    ]
+)
+
+
+class CSI:
+    """
+    This is a class to hold information from the kernel about the CSI information of the received network packet.
+    Attributes:
+        buf_len     (int):  length of the buffer in bytes.
+        tsf_stamp   (int): time (TSF) of when the packet arrived in microseconds.
+        csi_len     (int): length of the portion of the buffer in bytes.
+        channel     (int): center frequency of the wireless channel in MHz.
+        payload_len (int): length of the payload in the received packet in bytes.
+        phyerr      (int): phy error code, 0 if packet received successfully.
+        noise       (int): noise floor expressed in dB.
+        rate        (int): data rate of the received packet
+        chan_bw     (int): channel bandwidth =0 if 20MHz and =1 if 40MHz.
+        num_tones   (int): number of sub-carriers that was used in transmission.
+        nr          (int): number of receiving antennae
+        nc          (int): number of transmitting antennae
+        rssi        (int): rssi of combination of all the active chains.
+        rssi_0      (int): rssi of active chain 0
+        rssi_1      (int): rssi of active chain 1
+        rssi_2      (int): rssi of active chain 2
+        data        (numpy array): csi data of the received packet, one row of num_tones complex pairs per nr * nc group
+        csi_buff    (memoryview):  raw csi bytes of a lazily parsed packet, decoded into data the first time data is
+                                   read and dropped then, None otherwise
+    """
+
+    def __init__(self):
+        """
+        The constructor for the CSI class
+        Set each individual thing, avoided having lengthy constructor call
+        """
+        self.buf_len = 0
+        self.tfs_stamp = 0
+        self.csi_len = 0
+        self.channel = 0
+        self.payload_len = 0
+        self.phyerr = 0
+        self.noise = 0
+        self.rate = 0
+        self.chan_bw = 0
+        self.num_tones = 0
+        self.nr = 0
+        self.nc = 0
+        self.rssi = 0
+        self.rssi_0 = 0
+        self.rssi_1 = 0
+        self.rssi_2 = 0
+        self.csi_buff = None
+        self._data = []
+
+    @property
+    def data(self):
+        if self.csi_buff is not None:
+            import CSI_Python_Parser  # imports this module, so only once it is needed
+            self._data = CSI_Python_Parser.decode_CSI_data(self.csi_buff, self.nr, self.nc, self.num_tones, True)
+            self.csi_buff = None
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.csi_buff = None
+
+    def print_status(self):
+        """
+        Prints to the terminal the meta data for the received packet
+        :return:
+        """
+        print("Status Report")
+        print("csi_len is:      ", self.csi_len)
+        print("Channel is:      ", self.channel)
+        print("err_info is:     ", self.phyerr)
+        print("noise_floor is:  ", self.noise)
+        print("Rate is:         ", self.rate)
+        print("bandWidth is:    ", self.chan_bw)
+        print("num_tones is:    ", self.num_tones)
+        print("nr is:           ", self.nr)
+        print("nc is:           ", self.nc)
+        print("rssi is:         ", self.rssi)
+        print("rssi1 is:        ", self.rssi_0)
+        print("rssi2 is:        ", self.rssi_1)
+        print("rssi3 is:        ", self.rssi_2)
+        print("payload_len is:  ", self.payload_len)
+        print("")
+
+
+class CSIArray:
+    """
+    Columnar container for many packets, replaces a list of CSI objects.
+    Attributes:
+        meta        (numpy array): structured array of META_DTYPE, one row per packet
+        data        (numpy array): csi data of all packets, shape (packets, streams, tones) padded with zeros to the
+                                   largest nr * nc and num_tones; complex, or int16 with a trailing (real, imag) axis
+    """
+
+    def __init__(self, meta, data):
+        """
+        The constructor for the CSIArray class
+        :param meta: structured array of META_DTYPE
+        :param data: complex array of shape (packets, streams, tones) or int16 array of shape (packets, streams, tones, 2)
+        """
+        self.meta = meta
+        self.data = data
+
+    @classmethod
+    def from_decoded(cls, meta, decoded, compact=False):
+        """
+        Build the container from batch decoded CSI
+        :param meta: structured array of META_DTYPE
+        :param decoded: dict from CSI_Python_Parser.decode_CSI_batch, packet indices index into meta
+        :param compact: store the csi as int16 (real, imag) pairs instead of complex, a quarter of the memory
+        :return: CSIArray
+        """
+        max_streams = max([data.shape[1] for packet_idxs, data in decoded.values()], default=0)
+        max_tones = max([data.shape[2] for packet_idxs, data in decoded.values()], default=0)
+        if compact:
+            all_data = np.zeros((len(meta), max_streams, max_tones, 2), dtype=np.int16)
+        else:
+            all_data = np.zeros((len(meta), max_streams, max_tones), dtype=complex)
+
+        for packet_idxs, data in decoded.values():
+            num_streams, num_tones = data.shape[1:]
+            if compact:
+                all_data[packet_idxs, :num_streams, :num_tones, 0] = data.real
+                all_data[packet_idxs, :num_streams, :num_tones, 1] = data.imag
+            else:
+                all_data[packet_idxs, :num_streams, :num_tones] = data
+        return cls(meta, all_data)
+
+    def __len__(self):
+        return len(self.meta)
+
+    def __getitem__(self, key):
+        """
+        An int gives a CSIView of one packet, a slice, boolean mask or index array gives a new CSIArray
+        """
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self.meta)
+            if not 0 <= key < len(self.meta):
+                raise IndexError("packet index out of range")
+            return CSIView(self, key)
+        return CSIArray(self.meta[key], self.data[key])
+
+    def __iter__(self):
+        for idx in range(len(self.meta)):
+            yield CSIView(self, idx)
+
+    def packet_data(self, idx):
+        """
+        CSI of one packet trimmed to its own shape
+        :param idx: index of the packet
+        :return: complex array of shape (nr * nc, num_tones), empty if the packet has no CSI
+        """
+        row = self.meta[idx]
+        if row["csi_len"] == 0:
+            return np.empty((0, 0), dtype=complex)
+        num_streams = int(row["nr"]) * int(row["nc"])
+        num_tones = int(row["num_tones"])
+        if self.data.dtype == complex:
+            return self.data[idx, :num_streams, :num_tones]
+        pairs = self.data[idx, :num_streams, :num_tones]
+        data = np.empty((num_streams, num_tones), dtype=complex)
+        data.real = pairs[..., 0]
+        data.imag = pairs[..., 1]
+        return data
+
+
+class CSIView:
+    """
+    Lightweight view of one packet in a CSIArray that behaves like a CSI object.
+    """
+
+    __slots__ = ("_array", "_idx")
+
+    def __init__(self, array, idx):
+        self._array = array
+        self._idx = idx
+
+    def __getattr__(self, name):
+        if name in META_DTYPE.names:
+            return int(self._array.meta[name][self._idx])
+        raise AttributeError(name)
+
+    @property
+    def data(self):
+        return self._array.packet_data(self._idx)
+
+    print_status = CSI.print_status
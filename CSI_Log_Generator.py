@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+import CSI_Class
+import CSI_Log_Reader
+import CSI_Options
+import CSI_Python_Parser
+
+
+GENERATE_CHUNK = 8192  # records built and written at once
+NUM_PATHS = 4  # multipath components of the synthetic channel of every stream
+CSI_SCALE = 200.0  # typical magnitude of a synthetic CSI value, well inside the 10 bit range
+PACKET_JITTER = 0.1  # how much the channel of one packet varies from the stream's base channel
+NOISE_LEVEL = 4.0  # standard deviation of the noise added to every CSI value
+
+
+def record_dtype(csi_len, payload_size):
+    """
+    Layout of one record as to_file writes it
+    :param csi_len: bytes of CSI per record
+    :param payload_size: bytes of payload per record
+    :return: numpy structured dtype, CSI_Class.META_DTYPE followed by the csi and the payload
+    """
+    return np.dtype(CSI_Class.META_DTYPE.descr + [("csi", "u1", (csi_len,)), ("payload", "u1", (payload_size,))])
+
+
+class SyntheticChannel:
+    """
+    Multipath channel of every stream, packets see it with a little random variation on top plus noise,
+    so the CSI has the smooth across tones structure of a real capture instead of being white noise.
+    """
+
+    def __init__(self, rng, num_streams, num_tones):
+        self.rng = rng
+        self.num_streams = num_streams
+        self.num_tones = num_tones
+        gains = rng.normal(size=(num_streams, NUM_PATHS)) + 1j * rng.normal(size=(num_streams, NUM_PATHS))
+        self.gains = (gains * CSI_SCALE / np.sqrt(2 * NUM_PATHS)).astype(np.complex64)
+        delays = rng.uniform(0, 0.2, size=(num_streams, NUM_PATHS))  # in units of the symbol time
+        phases = np.exp(-2j * np.pi * delays[:, :, np.newaxis] * np.arange(num_tones))  # (streams, paths, tones)
+        self.phases = phases.astype(np.complex64)
+
+    def sample(self, num_packets):
+        """
+        CSI of the next packets
+        :param num_packets: number of packets
+        :return: complex numpy array of shape (num_packets, num_streams, num_tones)
+        """
+        jitter = self.complex_normal((num_packets, self.num_streams, NUM_PATHS))
+        jitter *= PACKET_JITTER
+        jitter += 1
+        data = np.einsum("psl,slt->pst", self.gains * jitter, self.phases)
+        data += NOISE_LEVEL * self.complex_normal((num_packets, self.num_streams, self.num_tones))
+        return data
+
+    def complex_normal(self, shape):
+        """
+        Complex gaussian samples in single precision, plenty for values that end up as 10 bit integers
+        :param shape: shape of the samples
+        :return: complex64 numpy array
+        """
+        samples = self.rng.standard_normal(shape + (2,), dtype=np.float32)
+        return samples.view(np.complex64)[..., 0]
+
+
+def generate_log(log_file, num_packets, nr=2, nc=2, num_tones=56, payload_size=CSI_Python_Parser.PING_PAYLOAD_SIZE,
+                 interval_us=1000, seed=0):
+    """
+    Write a synthetic capture log, every record has a status header, encoded CSI and a payload
+    :param log_file: path of the log to write
+    :param num_packets: number of records, all of them with CSI
+    :param nr: number of receiving antennae
+    :param nc: number of transmitting antennae
+    :param num_tones: number of sub-carriers
+    :param payload_size: payload bytes of every record
+    :param interval_us: mean time between packets in microseconds, the TSF steps are exponentially distributed
+    :param seed: seed of the random data
+    :return: size of the log in bytes
+    """
+    rng = np.random.default_rng(seed)
+    channel = SyntheticChannel(rng, nr * nc, num_tones)
+    csi_len = 2 * CSI_Python_Parser.csi_word_count(nr, nc, num_tones)
+    dtype = record_dtype(csi_len, payload_size)
+    tsf = 0
+
+    with open(log_file, "wb") as f:
+        for start in range(0, num_packets, GENERATE_CHUNK):
+            count = min(GENERATE_CHUNK, num_packets - start)
+            records = np.zeros(count, dtype=dtype)
+            records["buf_len"] = CSI_Log_Reader.META_STRUCT.size + csi_len + payload_size
+            steps = np.maximum(1, rng.exponential(interval_us, count)).astype(np.uint64)
+            records["tfs_stamp"] = tsf + np.cumsum(steps)
+            tsf = int(records["tfs_stamp"][-1])
+            records["csi_len"] = csi_len
+            records["channel"] = 2437
+            records["noise"] = rng.integers(0, 8, count)
+            records["rate"] = 0x8b
+            records["chan_bw"] = num_tones > 56
+            records["num_tones"] = num_tones
+            records["nr"] = nr
+            records["nc"] = nc
+            rssi = rng.normal(40, 3, (count, 3)).clip(0, 127).astype(np.uint8)
+            records["rssi_0"], records["rssi_1"], records["rssi_2"] = rssi.T
+            records["rssi"] = rssi.max(axis=1)
+            records["payload_len"] = payload_size
+            records["csi"] = CSI_Python_Parser.encode_CSI_batch(channel.sample(count), nr, nc)
+            if payload_size:
+                records["payload"] = rng.integers(0, 256, (count, payload_size), dtype=np.uint8)
+            f.write(records.tobytes())
+    return os.path.getsize(log_file)
+
+
+def generate_seq_csvs(num_packets, bob_csv, eve_csv, bob_rate=0.5, eve_rate=0.5, overlap=0.5, seed=0):
+    """
+    Write bob and eve csvs of the packet numbers each of them received
+    :param num_packets: number of packets in the log
+    :param bob_csv: path of the bob csv
+    :param eve_csv: path of the eve csv
+    :param bob_rate: fraction of the packets bob received
+    :param eve_rate: fraction of the packets eve received, as far as overlap allows
+    :param overlap: fraction of bob's packets that eve received too, the rest of eve's are ones bob missed
+    :param seed: seed of the random choice
+    :return: (bob packet numbers, eve packet numbers)
+    """
+    rng = np.random.default_rng(seed)
+    bob = rng.random(num_packets) < bob_rate
+    eve_missed_rate = 0.0 if bob_rate >= 1 else min(1.0, max(0.0, (eve_rate - bob_rate * overlap) / (1 - bob_rate)))
+    eve = np.where(bob, rng.random(num_packets) < overlap, rng.random(num_packets) < eve_missed_rate)
+    bob_nums = np.flatnonzero(bob) + 1
+    eve_nums = np.flatnonzero(eve) + 1
+    np.savetxt(bob_csv, bob_nums, fmt="%d")
+    np.savetxt(eve_csv, eve_nums, fmt="%d")
+    return bob_nums, eve_nums
+
+
+def main():
+    args, options = CSI_Options.parse_options(sys.argv[1:], {
+        "packets": int, "size-mb": float, "nr": int, "nc": int, "tones": int, "payload": int, "interval-us": float,
+        "bob": str, "eve": str, "bob-rate": float, "eve-rate": float, "overlap": float, "seed": int,
+    })
+    if options is None or len(args) != 1:
+        print("python CSI_Log_Generator.py log_file [--packets N | --size-mb MB] [--nr 2] [--nc 2] [--tones 56] "
+              "[--payload 766] [--interval-us 1000] [--bob bob.csv] [--eve eve.csv] [--bob-rate 0.5] "
+              "[--eve-rate 0.5] [--overlap 0.5] [--seed 0]")
+        return
+
+    log_file = args[0]
+    nr, nc, num_tones = options.get("nr", 2), options.get("nc", 2), options.get("tones", 56)
+    payload_size = options.get("payload", CSI_Python_Parser.PING_PAYLOAD_SIZE)
+    num_packets = options.get("packets", 100000)
+    if "size-mb" in options:
+        record_len = CSI_Log_Reader.RECORD_HEADER_LEN + 2 * CSI_Python_Parser.csi_word_count(nr, nc, num_tones) + payload_size
+        num_packets = max(1, int(options["size-mb"] * 1e6 / record_len))
+    seed = options.get("seed", 0)
+
+    start = time.perf_counter()
+    try:
+        log_size = generate_log(log_file, num_packets, nr, nc, num_tones, payload_size,
+                                options.get("interval-us", 1000), seed)
+        bob_nums, eve_nums = generate_seq_csvs(
+            num_packets, options.get("bob", log_file + ".bob.csv"), options.get("eve", log_file + ".eve.csv"),
+            options.get("bob-rate", 0.5), options.get("eve-rate", 0.5), options.get("overlap", 0.5), seed + 1,
+        )
+    except IOError as e:
+        print("Couldn't write file:", e)
+        return
+    seconds = max(time.perf_counter() - start, 1e-9)
+    print("Wrote %d packets, %.1f MB in %.2f s (%.1f MB/s), bob got %d and eve %d of them"
+          % (num_packets, log_size / 1e6, seconds, log_size / 1e6 / seconds, len(bob_nums), len(eve_nums)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import os
+import struct
+import sys
+
+import numpy as np
+
+import CSI_Log_Reader
+
+
+INDEX_SUFFIX = ".idx"  # the index is stored next to the log as <log>.idx
+INDEX_MAGIC = b"CSIIDX01"
+INDEX_HEADER = struct.Struct("<8sQqQ")  # magic, log size, log mtime in ns, number of records
+
+# one fixed width row per record of the log
+INDEX_DTYPE = np.dtype(
+    [
+        ("offset", "<u8"),
+        ("tsf", "<u8"),
+        ("csi_len", "<u2"),
+        ("payload_len", "<u2"),
+        ("nr", "u1"),
+        ("nc", "u1"),
+        ("num_tones", "u1"),
+        ("rssi", "u1"),
+    ]
+)
+
+
+def index_file_name(log_file):
+    """
+    Name of the sidecar index of a log
+    :param log_file: path of the CSI log
+    :return: path of the index file
+    """
+    return log_file + INDEX_SUFFIX
+
+
+def build_index(log_file):
+    """
+    Walk the log once and collect one index row for every complete record
+    :param log_file: path of the CSI log
+    :return: (structured numpy array of INDEX_DTYPE, log size, log mtime in ns)
+    """
+    with CSI_Log_Reader.CSILogReader(log_file) as reader:
+        stat = os.stat(log_file)
+        rows = (
+            (offset, meta_data[0], meta_data[1], meta_data[14], meta_data[8], meta_data[9], meta_data[7], meta_data[10])
+            for offset, meta_data, csi_buff in reader.records(legacy_cutoff=False)
+        )
+        records = np.fromiter(rows, dtype=INDEX_DTYPE)
+        return records, reader.size, stat.st_mtime_ns
+
+
+def write_index(log_file, records, log_size, log_mtime_ns):
+    """
+    Store an index next to its log, written to a temporary file first so readers never see half an index
+    :param log_file: path of the CSI log
+    :param records: structured numpy array of INDEX_DTYPE
+    :param log_size: size of the log the index was built from
+    :param log_mtime_ns: mtime of the log the index was built from
+    :return:
+    """
+    idx_file = index_file_name(log_file)
+    tmp_file = idx_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, log_size, log_mtime_ns, len(records)))
+        f.write(records.tobytes())
+    os.replace(tmp_file, idx_file)
+
+
+def read_index(log_file):
+    """
+    Load the sidecar index of a log if it still matches the log's size and mtime
+    :param log_file: path of the CSI log
+    :return: memory mapped structured numpy array of INDEX_DTYPE, or None if there is no valid index
+    """
+    idx_file = index_file_name(log_file)
+    try:
+        stat = os.stat(log_file)
+        with open(idx_file, "rb") as f:
+            header = f.read(INDEX_HEADER.size)
+    except IOError:
+        return None
+    if len(header) != INDEX_HEADER.size:
+        return None
+
+    magic, log_size, log_mtime_ns, num_records = INDEX_HEADER.unpack(header)
+    if magic != INDEX_MAGIC or log_size != stat.st_size or log_mtime_ns != stat.st_mtime_ns:
+        return None
+    if os.stat(idx_file).st_size != INDEX_HEADER.size + num_records * INDEX_DTYPE.itemsize:
+        return None
+    if num_records == 0:
+        return np.empty(0, dtype=INDEX_DTYPE)
+    return np.memmap(idx_file, dtype=INDEX_DTYPE, mode="r", offset=INDEX_HEADER.size, shape=(num_records,))
+
+
+class CSILogIndex:
+    """
+    Random access into a CSI log through its sidecar index.
+    Attributes:
+        log_file    (str):          path of the CSI log
+        log_size    (int):          size of the log in bytes the index matches
+        records     (numpy array):  one INDEX_DTYPE row per record, in file order
+    """
+
+    def __init__(self, log_file, rebuild=False):
+        """
+        Load the index of a log, building and storing it first if it is missing or stale
+        :param log_file: path of the CSI log
+        :param rebuild: always rebuild the index
+        """
+        self.log_file = log_file
+        self.log_size = os.stat(log_file).st_size
+        self.records = None if rebuild else read_index(log_file)
+        if self.records is None:
+            self.records, self.log_size, log_mtime_ns = build_index(log_file)
+            try:
+                write_index(log_file, self.records, self.log_size, log_mtime_ns)
+            except IOError:
+                print("Couldn't write index file: ", index_file_name(log_file))
+        self._packet_records = None
+        self._tsf_order = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def legacy_count(self):
+        """
+        Number of leading records the compile functions read, see CSI_Log_Reader.legacy_record_count
+        :return: record count
+        """
+        return CSI_Log_Reader.legacy_record_count(self.records["csi_len"], self.records["payload_len"], self.log_size)
+
+    def record_offset(self, record_num):
+        """
+        Byte offset of a record
+        :param record_num: 0 based record number
+        :return: offset of the record's buf_len prefix in the log
+        """
+        return int(self.records["offset"][record_num])
+
+    def packet_record(self, packet_num):
+        """
+        Record number of a packet, numbered like the compile functions do (1 based, only records with CSI)
+        :param packet_num: packet number as used for the bob/eve sequence numbers
+        :return: 0 based record number
+        """
+        if self._packet_records is None:
+            self._packet_records = np.flatnonzero(self.records["csi_len"] > 0)
+        return int(self._packet_records[packet_num - 1])
+
+    def packet_offset(self, packet_num):
+        """
+        Byte offset of a packet
+        :param packet_num: packet number as used for the bob/eve sequence numbers
+        :return: offset of the packet's record in the log
+        """
+        return self.record_offset(self.packet_record(packet_num))
+
+    def tsf_range(self, tsf_start, tsf_end):
+        """
+        Binary search for every record with tsf_start <= TSF < tsf_end
+        :param tsf_start: first TSF to include in microseconds
+        :param tsf_end: first TSF to exclude in microseconds
+        :return: numpy array of 0 based record numbers in file order
+        """
+        tsf = self.records["tsf"]
+        if self._tsf_order is None:
+            # TSF only goes backwards if the card reset mid capture, search a sorted copy then
+            in_order = len(tsf) < 2 or bool(np.all(tsf[1:] >= tsf[:-1]))
+            self._tsf_order = np.arange(len(tsf)) if in_order else np.argsort(tsf, kind="stable")
+        sorted_tsf = tsf[self._tsf_order]
+        first = np.searchsorted(sorted_tsf, tsf_start, side="left")
+        last = np.searchsorted(sorted_tsf, tsf_end, side="left")
+        return np.sort(self._tsf_order[first:last])
+
+    def read_records(self, reader, record_nums):
+        """
+        Read the given records straight from their offsets
+        :param reader: CSI_Log_Reader.CSILogReader opened on the same log
+        :param record_nums: iterable of 0 based record numbers
+        :return: generator of (offset, meta_data, csi_view) like CSILogReader.records
+        """
+        for record_num in record_nums:
+            offset = self.record_offset(record_num)
+            meta_data, csi_view, next_offset = reader.read_record(offset)
+            yield offset, meta_data, csi_view
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("python CSI_Log_Index.py csi_log_file")
+        return
+    try:
+        index = CSILogIndex(sys.argv[1], rebuild=True)
+    except IOError:
+        print("Couldn't open file!")
+        return
+    print("Indexed", len(index), "records into", index_file_name(sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import mmap
+import os
+import struct
+
+import numpy as np
+
+
+TWO_BYTE = struct.Struct("=H")  # buf_len prefix written by to_file
+META_STRUCT = struct.Struct("=QHHBBBBBBBBBBBH")  # status header of every record
+RECORD_HEADER_LEN = TWO_BYTE.size + META_STRUCT.size  # bytes in front of the CSI of every record
+
+LEGACY_RECORD_LEN = 53  # what the original parse loops add to cur per record (included a 26 byte time stamp)
+LEGACY_TAIL_LEN = 420  # the original parse loops stop once less than this is left after cur
+
+
+def legacy_record_count(csi_lens, payload_lens, log_size):
+    """
+    Number of records the original parse loops read before their cur + 420 > len_of_file stop
+    :param csi_lens: numpy array of the csi_len of every complete record in the log
+    :param payload_lens: numpy array of the payload_len of every complete record in the log
+    :param log_size: size of the log in bytes
+    :return: number of leading records that CSILogReader.records gives with legacy_cutoff
+    """
+    if log_size <= 4:
+        return 0
+    cursor = np.cumsum(LEGACY_RECORD_LEN + csi_lens.astype(np.int64) + payload_lens.astype(np.int64))
+    past_cutoff = np.flatnonzero(cursor + LEGACY_TAIL_LEN > log_size)
+    if len(past_cutoff) == 0:
+        return len(cursor)
+    return int(past_cutoff[0]) + 1
+
+
+class CSILogReader:
+    """
+    Memory mapped reader for CSI .dat logs written by CSI_Python_Parser.to_file.
+    Records are walked with unpack_from at offsets into the map and the CSI region of every record is
+    handed out as a memoryview slice, so reading a log never copies and skipping payloads costs nothing.
+    Attributes:
+        file_name   (str):          path of the opened log
+        size        (int):          size of the log in bytes when it was opened
+        view        (memoryview):   view over the whole log
+    """
+
+    def __init__(self, file_name):
+        """
+        Map the log file read only
+        :param file_name: name of the log file, raises IOError if it can't be opened
+        """
+        self.file_name = file_name
+        self._file = open(file_name, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._map = None
+        if self.size > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self._map)
+        else:
+            self.view = memoryview(b"")  # an empty file can't be mapped
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Release the map and the file, slices still held by the caller keep the map alive until they are dropped
+        :return:
+        """
+        self.view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # exported slices are still alive, the map is freed with them
+        self._file.close()
+
+    def read_buf_len(self, offset):
+        """
+        Read the buf_len prefix of the record that starts at offset
+        :param offset: byte offset of the record
+        :return: buf_len of the record
+        """
+        return TWO_BYTE.unpack_from(self.view, offset)[0]
+
+    def read_record(self, offset):
+        """
+        Read the record that starts at offset
+        :param offset: byte offset of the record's buf_len prefix
+        :return: (meta_data, csi_view, next_offset), or None if there is no complete record at offset
+        """
+        csi_start = offset + RECORD_HEADER_LEN
+        if csi_start > self.size:
+            return None
+        meta_data = META_STRUCT.unpack_from(self.view, offset + TWO_BYTE.size)
+        csi_end = csi_start + meta_data[1]
+        next_offset = csi_end + meta_data[14]
+        if next_offset > self.size:
+            return None
+        return meta_data, self.view[csi_start:csi_end], next_offset
+
+    def records(self, offset=0, legacy_cutoff=True, cursor=None, end=None):
+        """
+        Walk the records of the log
+        :param offset: byte offset of the first record to read
+        :param legacy_cutoff: stop where the original parse loops stopped (cur + 420 > len_of_file) instead of at the last complete record
+        :param cursor: value of the original loops' cur for the record at offset, defaults to offset
+        :param end: byte offset to stop at, a record starting at or after it is not read
+        :return: generator of (offset, meta_data, csi_view) for every record, meta_data is the unpacked status header
+        """
+        if cursor is None:
+            cursor = offset
+        if legacy_cutoff and offset > 0 and cursor + LEGACY_TAIL_LEN > self.size:
+            return  # resuming after the record that hit the cut-off
+        while not legacy_cutoff or cursor < (self.size - 4):
+            if end is not None and offset >= end:
+                break
+            record = self.read_record(offset)
+            if record is None:
+                break
+            meta_data, csi_view, next_offset = record
+            yield offset, meta_data, csi_view
+
+            offset = next_offset
+            cursor += LEGACY_RECORD_LEN + meta_data[1] + meta_data[14]
+            if legacy_cutoff and cursor + LEGACY_TAIL_LEN > self.size:
+                break
@@ -0,0 +1,143 @@
+import queue
+import struct
+import threading
+import time
+
+
+TWO_BYTE = struct.Struct("=H")  # buf_len prefix of every record, like CSI_Python_Parser.to_file writes it
+
+LOG_BLOCK_SIZE = 1 << 16  # bytes per write, the log is written in whole blocks except when flushed early
+LOG_QUEUE_BLOCKS = 64  # blocks that can be filled or waiting for the writer thread at once
+LOG_FLUSH_INTERVAL = 1.0  # seconds a partly filled block may wait before it is written anyway
+
+
+class AsyncLogWriter:
+    """
+    Writes captured records to a log from a background thread, so slow storage never stalls the capture loop.
+    Records are copied in the to_file format (buf_len, then the record) into preallocated blocks, and every full
+    block goes through a bounded queue to the writer thread, which writes it with a single call. Records span
+    block boundaries, so every write is exactly block_size bytes except an early flush of a partly filled block.
+    The writes are only block_size aligned until the first early flush, after it every write is shifted by the
+    bytes it wrote.
+    Once every block is in use the capture loop either waits for the writer thread or drops the record.
+    Attributes:
+        log_file        (file):     log opened for binary writing, closed by close()
+        block_size      (int):      bytes per block
+        flush_interval  (float):    seconds a partly filled block may wait before it is written
+        drop            (bool):     drop records while no block is free instead of waiting for one
+        written         (int):      records accepted, all of them are in the log once close() returns
+        dropped         (int):      records dropped because no block was free
+        error           (IOError):  first error writing the log, None if there was none
+        write_latency   (object):   CSI_Capture_Stats.LatencyHistogram every write to storage is timed into, or None
+    """
+
+    def __init__(self, log_file, block_size=LOG_BLOCK_SIZE, num_blocks=LOG_QUEUE_BLOCKS,
+                 flush_interval=LOG_FLUSH_INTERVAL, drop=False, write_latency=None):
+        self.log_file = log_file
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.drop = drop
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self.write_latency = write_latency
+
+        self.free = queue.Queue()  # empty blocks, only the capture loop takes from it
+        for i in range(num_blocks):
+            self.free.put(memoryview(bytearray(block_size)))
+        self.full = queue.Queue()  # (block, length) for the writer thread, None stops it
+        self.lock = threading.Lock()  # guards the block being filled
+        self.block = None
+        self.fill = 0
+        self.prefix = bytearray(TWO_BYTE.size)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, buffer, buf_len):
+        """
+        Queue one record, called from the capture loop
+        :param buffer: record data, only read during the call so a reused read buffer is fine
+        :param buf_len: length of the record
+        :return: True if the record was queued, False if it was dropped
+        """
+        with self.lock:
+            # a record is only started when it can be finished, a dropped record never leaves half a record behind
+            room = self.block_size - self.fill if self.block is not None else 0
+            record_len = TWO_BYTE.size + buf_len
+            blocks_needed = -(-(record_len - room) // self.block_size) if record_len > room else 0
+            if self.drop and blocks_needed > self.free.qsize():
+                self.dropped += 1
+                return False
+
+            TWO_BYTE.pack_into(self.prefix, 0, buf_len)
+            self.put(self.prefix)
+            self.put(buffer[0:buf_len])
+            self.written += 1
+            return True
+
+    def put(self, data):
+        """
+        Copy bytes into the blocks, handing off every block that fills up, the lock must be held
+        :param data: bytes-like object
+        :return:
+        """
+        pos = 0
+        while pos < len(data):
+            if self.block is None:
+                self.block = self.free.get()  # waits for the writer thread when every block is in use
+                self.fill = 0
+            count = min(len(data) - pos, self.block_size - self.fill)
+            self.block[self.fill:self.fill + count] = data[pos:pos + count]
+            self.fill += count
+            pos += count
+            if self.fill == self.block_size:
+                self.hand_off()
+
+    def hand_off(self):
+        """
+        Pass the block being filled to the writer thread, the lock must be held
+        :return:
+        """
+        if self.block is not None and self.fill > 0:
+            self.full.put((self.block, self.fill))
+            self.block = None
+
+    def run(self):
+        """
+        Writer thread, writes blocks in order and flushes a partly filled block once it waited flush_interval
+        :return:
+        """
+        while True:
+            try:
+                item = self.full.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # never wait for the lock here, the capture loop may hold it while waiting for a free block
+                if self.lock.acquire(blocking=False):
+                    self.hand_off()
+                    self.lock.release()
+                continue
+            if item is None:
+                break
+            block, length = item
+            if self.error is None:
+                start_ns = time.perf_counter_ns()
+                try:
+                    self.log_file.write(block[0:length])
+                    self.log_file.flush()
+                except IOError as e:
+                    self.error = e
+                if self.write_latency is not None:
+                    self.write_latency.record(time.perf_counter_ns() - start_ns)
+            self.free.put(block)
+
+    def close(self):
+        """
+        Write everything still queued, stop the writer thread and close the log
+        :return:
+        """
+        with self.lock:
+            self.hand_off()
+        self.full.put(None)
+        self.thread.join()
+        self.log_file.close()
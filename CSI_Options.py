@@ -0,0 +1,47 @@
+import numpy as np
+
+
+def index_list(text):
+    """
+    Parse a list of indices and inclusive ranges like 0,2,4-8 given on the command line
+    :param text: option value
+    :return: int64 numpy array of the indices in the given order, raises ValueError if malformed
+    """
+    indices = []
+    for part in text.split(','):
+        first, dash, last = part.partition('-')
+        indices.extend(range(int(first), int(last) + 1) if dash else [int(first)])
+    return np.array(indices, dtype=np.int64)
+
+
+def parse_options(argv, flags):
+    """
+    Pull --name value options out of the command line arguments
+    :param argv: command line arguments
+    :param flags: dict of option name (without --) to a function that converts its value, e.g. int, or bool for an
+                  option that takes no value
+    :return: (positional arguments, dict of the given options), options is None if one was malformed
+    """
+    args = []
+    options = {}
+    i = 0
+    while i < len(argv):
+        if argv[i].startswith('--'):
+            name = argv[i][2:]
+            if flags.get(name) is bool:
+                options[name] = True
+                i += 1
+                continue
+            if name not in flags or i + 1 >= len(argv):
+                print("Unknown or incomplete option:", argv[i])
+                return args, None
+            try:
+                options[name] = flags[name](argv[i + 1])
+            except ValueError:
+                print("Bad value for option:", argv[i])
+                return args, None
+            i += 2
+        else:
+            args.append(argv[i])
+            i += 1
+    return args, options
@@ -1,14 +1,20 @@
+import collections
 import os
+import selectors
 import struct
 import sys
 import socket
+import stat
 import signal
 import time
 from datetime import datetime
 
 import numpy as np
 
+from CSI_Capture_Stats import CaptureStats
 from CSI_Class import *
+import CSI_Options
+from CSI_Log_Writer import AsyncLogWriter, LOG_FLUSH_INTERVAL
 
 
 BUFF_SIZE = 4096  # amount of bytes to read from buffer
@@ -21,18 +27,41 @@ NATIVE_UNSIGNED_CHAR = "=B"  # Unpacking 1 byte
 SECONDS_TO_RUN = 30
 DB_THRESHOLD = 40.0
 
+LOG_DROP_RECORDS = False  # drop records instead of stalling the capture when the log storage falls behind
+STATS_INTERVAL = 5.0  # seconds between writes of the --stats-file
+
+
+CSI_DEVICE = "/dev/CSI_dev"
+REPLY_ADDRESS = ("10.10.0.5", 5005)  # where the reply to every ping from bob is sent
 
 PING_PAYLOAD_SIZE = 766
 PACKET_SIZE = 1024
+COUNTER_SIZE = 8  # packet counter in front of the payload of every reply
+BUFFER_RING_SIZE = 8  # read buffers the capture loop cycles through
+
+# compiled once, the capture loop unpacks every packet with them
+TWO_BYTE_STRUCT = struct.Struct(NATIVE_UNSIGNED_SHORT)
+META_STRUCT = struct.Struct("=QHHBBBBBBBBBBBH")
+PACKET_COUNTER_STRUCT = struct.Struct(NATIVE_UNSIGNED_LONG_LONG)
 
 
-def open_csi_device():
+def open_csi_device(device=CSI_DEVICE):
     """
     Open and return file buffer to read CSI data from.
     /dev/CSI_dev may need be given read and write permissions
+    :param device: path of the device, a FIFO works as a stand in, fd:N uses the inherited file descriptor N
+                   (a pipe or socket from CSI_Replay)
     """
+    if device.startswith("fd:"):
+        return int(device[3:])
     try:
-        fd = os.open("/dev/CSI_dev", os.O_RDWR)
+        if stat.S_ISFIFO(os.stat(device).st_mode):
+            # a stand in FIFO is only read, without holding a write end the capture sees its end once the writer
+            # closes it. Not blocking in open means not waiting for the writer, the reads block again afterwards
+            fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK)
+            os.set_blocking(fd, True)
+            return fd
+        fd = os.open(device, os.O_RDWR)
         return fd
     except FileNotFoundError:
         print("Failed to open the device....")
@@ -47,13 +76,43 @@ def close_csi_device(fileName):
     os.close(fileName)
 
 
-def read_csi_data(fd, BUFFSIZE):
+class BufferRing:
+    """
+    Preallocated read buffers handed out round robin, so the capture loop doesn't allocate a buffer per read.
+    A buffer is read into again BUFFER_RING_SIZE reads later, a record kept longer than that has to be copied.
+    Attributes:
+        buffers (list): bytearrays of buff_size bytes
+        iovecs  (list): one [memoryview] list per buffer, ready to pass to os.readv
+    """
+
+    def __init__(self, size=BUFFER_RING_SIZE, buff_size=BUFF_SIZE):
+        self.buffers = [bytearray(buff_size) for i in range(size)]
+        self.iovecs = [[memoryview(buffer)] for buffer in self.buffers]
+        self.pos = 0
+
+    def next(self):
+        """
+        Take the next buffer of the ring
+        :return: [memoryview] of the buffer
+        """
+        iovec = self.iovecs[self.pos]
+        self.pos += 1
+        if self.pos == len(self.iovecs):
+            self.pos = 0
+        return iovec
+
+
+def read_csi_data(fd, BUFFSIZE, ring=None):
     """
     Read CSI status and CSI data from file buffer to our own buffer
     :param fd: opened file buffer
     :param BUFFSIZE: size to read from file buffer
+    :param ring: BufferRing to read into instead of a new buffer, BUFFSIZE is the ring's buffer size then
     :return: how many bytes were read from file buffer, our buffer (buffer contains bytes)
     """
+    if ring is not None:
+        iovec = ring.next()
+        return os.readv(fd, iovec), iovec[0]
     info_array = bytearray(BUFFSIZE)
     cnt = os.readv(fd, [info_array])
     return cnt, info_array
@@ -62,16 +121,14 @@ def read_csi_data(fd, BUFFSIZE):
 def record_status(buff, cnt):
     """
     Retrieve meta data from buffer about received packet
-    :param buff: buffer to read from
+    :param buff: buffer to read from (bytearray or memoryview), nothing is copied out of it
     :param cnt: how many bytes are in the buffer
     :return: csi_object full of meta/status data
     """
-    two_byte = struct.Struct(NATIVE_UNSIGNED_SHORT)
-    meta_struct = struct.Struct("=QHHBBBBBBBBBBBH")
 
     # csi_object = CSI()
     # csi_object.time_stamp = datetime.now(tz=None).__str__()
-    meta_data = meta_struct.unpack(buff[0:25])
+    meta_data = META_STRUCT.unpack_from(buff, 0)
     # csi_object.tfs_stamp = meta_data[0]
     # csi_object.csi_len = meta_data[1]
     # csi_object.channel = meta_data[2]
@@ -87,7 +144,7 @@ def record_status(buff, cnt):
     # csi_object.rssi_1 = meta_data[12]
     # csi_object.rssi_2 = meta_data[13]
     # csi_object.payload_len = meta_data[14]
-    buf_len = two_byte.unpack(buff[cnt - 2: cnt])[0]
+    buf_len = TWO_BYTE_STRUCT.unpack_from(buff, cnt - 2)[0]
 
     # return csi_object
     return meta_data, buf_len
@@ -120,7 +177,7 @@ def record_CSI_data(buff, nr, nc, num_tones, from_file):
     # list of numpy arrays to hold CSI data
     data = []
     for x in range(0, nr * nc):
-        data.append(np.empty(num_tones, dtype=np.complex))
+        data.append(np.empty(num_tones, dtype=complex))
 
     index = CSI_ST_LEN + 2  # starting index
     if from_file:
@@ -181,6 +238,227 @@ def record_CSI_data(buff, nr, nc, num_tones, from_file):
     return data
 
 
+def csi_word_count(nr, nc, num_tones):
+    """
+    Number of 16 bit words that hold the packed CSI of one packet
+    :param nr: number of receiving antennae
+    :param nc: number of transmitting antennae
+    :param num_tones: number of sub-carriers
+    :return: word count, always at least one word like record_CSI_data reads
+    """
+    num_bits = 2 * BIT_RESOLUTION * nr * nc * num_tones
+    return max(1, -(-num_bits // 16))
+
+
+def extract_csi_fields(words, field_idx):
+    """
+    Pull BIT_RESOLUTION wide fields out of a packed little-endian bit stream
+    :param words: uint16 numpy array, the last axis is the packed bit stream of one packet
+    :param field_idx: numpy array of field numbers to extract (field n starts at bit n * BIT_RESOLUTION)
+    :return: int16 numpy array of sign extended fields with shape words.shape[:-1] + field_idx.shape
+    """
+    bit_pos = np.asarray(field_idx, dtype=np.int64) * BIT_RESOLUTION
+    word_idx = bit_pos >> 4
+    shift = (bit_pos & 15).astype(np.uint32)
+
+    # a field can straddle two words, pad with a zero word so the last field always has a partner
+    padded = np.zeros(words.shape[:-1] + (words.shape[-1] + 1,), dtype=np.uint32)
+    padded[..., :-1] = words
+    pairs = padded[..., word_idx] | (padded[..., word_idx + 1] << 16)
+
+    fields = ((pairs >> shift) & ((1 << BIT_RESOLUTION) - 1)).astype(np.int16)
+    fields -= (fields & (1 << (BIT_RESOLUTION - 1))) << 1  # same as bit_convert for every field
+    return fields
+
+
+def select_indices(selection, count):
+    """
+    Indices picked by a stream or tone selection
+    :param selection: None for all of them, a bool mask or an array of indices
+    :param count: number of streams or tones the packet has, selected indices past it are dropped
+    :return: int64 numpy array of indices
+    """
+    if selection is None:
+        return np.arange(count)
+    selection = np.asarray(selection)
+    if selection.dtype == bool:
+        selection = np.flatnonzero(selection)
+    selection = selection.astype(np.int64)
+    return selection[selection < count]
+
+
+def csi_field_index(num_streams, num_tones, streams=None, tones=None):
+    """
+    Fields of the packed CSI that hold the selected streams and tones, in the order fields_to_complex expects
+    :param num_streams: number of streams (nr * nc) of the packet
+    :param num_tones: number of sub-carriers of the packet
+    :param streams: stream selection for select_indices, None for all
+    :param tones: tone selection for select_indices, None for all
+    :return: (int64 numpy array of field numbers, selected stream count, selected tone count)
+    """
+    stream_idx = select_indices(streams, num_streams)
+    tone_idx = select_indices(tones, num_tones)
+    pair_idx = tone_idx[:, np.newaxis] * num_streams + stream_idx  # (imag, real) pair of every (tone, stream)
+    field_idx = 2 * pair_idx[..., np.newaxis] + np.arange(2)
+    return field_idx.reshape(-1), len(stream_idx), len(tone_idx)
+
+
+def fields_to_complex(fields, num_streams, num_tones):
+    """
+    Turn extracted (imag, real) field pairs into complex CSI
+    :param fields: int16 numpy array of fields, last axis ordered tone, stream, imag/real
+    :param num_streams: number of streams (nr * nc)
+    :param num_tones: number of sub-carriers
+    :return: complex numpy array of shape fields.shape[:-1] + (num_streams, num_tones)
+    """
+    pairs = fields.reshape(fields.shape[:-1] + (num_tones, num_streams, 2))
+    pairs = np.swapaxes(pairs, -3, -2)
+    data = np.empty(pairs.shape[:-1], dtype=complex)
+    data.real = pairs[..., 1]
+    data.imag = pairs[..., 0]
+    return data
+
+
+def complex_to_fields(data):
+    """
+    Inverse of fields_to_complex, rounds to the nearest BIT_RESOLUTION bit signed integer
+    :param data: complex numpy array, the last two axes are (num_streams, num_tones)
+    :return: int16 numpy array of fields, last axis ordered tone, stream, imag/real
+    """
+    limit = 1 << (BIT_RESOLUTION - 1)
+    pairs = np.empty(data.shape + (2,), dtype=np.int16)
+    pairs[..., 0] = np.clip(np.rint(data.imag), -limit, limit - 1)
+    pairs[..., 1] = np.clip(np.rint(data.real), -limit, limit - 1)
+    pairs = np.swapaxes(pairs, -3, -2)
+    return pairs.reshape(data.shape[:-2] + (-1,))
+
+
+def pack_csi_fields(fields, num_words):
+    """
+    Inverse of extract_csi_fields for all fields at once, field n goes to bit n * BIT_RESOLUTION
+    :param fields: integer numpy array, the last axis holds the fields of one packet
+    :param num_words: number of 16 bit words per packet
+    :return: uint8 numpy array of shape fields.shape[:-1] + (2 * num_words,), the packed little-endian bit stream
+    """
+    # fields and words line up again every lcm(16, BIT_RESOLUTION) bits, pack one such group of each at a time
+    group_bits = int(np.lcm(16, BIT_RESOLUTION))
+    group_fields = group_bits // BIT_RESOLUTION
+    group_words = group_bits // 16
+    lead_shape = fields.shape[:-1]
+    num_groups = -(-fields.shape[-1] // group_fields)
+
+    padded = np.zeros(lead_shape + (num_groups * group_fields,), dtype=np.uint32)
+    padded[..., :fields.shape[-1]] = fields.astype(np.uint32) & ((1 << BIT_RESOLUTION) - 1)
+    padded = padded.reshape(lead_shape + (num_groups, group_fields))
+
+    words = np.zeros(lead_shape + (num_groups, group_words), dtype=np.uint32)
+    for field in range(group_fields):
+        bit_pos = field * BIT_RESOLUTION
+        word, shift = bit_pos >> 4, bit_pos & 15
+        words[..., word] |= padded[..., field] << shift
+        if shift + BIT_RESOLUTION > 16:  # the field straddles two words
+            words[..., word + 1] |= padded[..., field] >> (16 - shift)
+
+    packed = np.zeros(lead_shape + (num_words,), dtype="<u2")
+    count = min(num_words, num_groups * group_words)
+    packed[..., :count] = words.reshape(lead_shape + (-1,))[..., :count]
+    return packed.view(np.uint8)
+
+
+def encode_CSI_batch(data, nr, nc):
+    """
+    Pack the CSI of many packets into the layout record_CSI_data reads, the inverse of decode_CSI_batch for one shape
+    :param data: complex numpy array of shape (packets, nr * nc, num_tones)
+    :param nr: number of receiving antennae
+    :param nc: number of transmitting antennae
+    :return: uint8 numpy array of shape (packets, csi_len)
+    """
+    num_tones = data.shape[-1]
+    return pack_csi_fields(complex_to_fields(data), csi_word_count(nr, nc, num_tones))
+
+
+def encode_CSI_data(data, nr, nc, num_tones):
+    """
+    Pack the CSI of one packet, the inverse of record_CSI_data and decode_CSI_data
+    :param data: complex numpy array of shape (nr * nc, num_tones), or a list of nr * nc arrays of num_tones values
+    :param nr: number of receiving antennae
+    :param nc: number of transmitting antennae
+    :param num_tones: number of sub-carriers
+    :return: csi bytes as they follow the status header of a record
+    """
+    data = np.asarray(data).reshape(1, nr * nc, num_tones)
+    return encode_CSI_batch(data, nr, nc)[0].tobytes()
+
+
+def selected_word_count(field_idx):
+    """
+    Number of 16 bit words from the start of the packed CSI that hold the selected fields
+    :param field_idx: numpy array of field numbers
+    :return: word count, at least one
+    """
+    if len(field_idx) == 0:
+        return 1
+    return -(-(int(field_idx.max()) + 1) * BIT_RESOLUTION // 16)
+
+
+def decode_CSI_data(buff, nr, nc, num_tones, from_file, streams=None, tones=None):
+    """
+    Vectorized version of record_CSI_data, decodes the whole CSI buffer at once
+    :param buff: csi data buffer (bytes, bytearray, memoryview or mmap)
+    :param nr: number of receiving antennae
+    :param nc: number of transmitting antennae
+    :param num_tones: number of sub-carriers
+    :param from_file: reading from a file instead of kernel?
+    :param streams: only decode these streams, a bool mask or indices of the nr * nc streams, None for all
+    :param tones: only decode these sub-carriers, a bool mask or indices, None for all
+    :return: complex numpy array of shape (nr * nc, num_tones), row nc_idx * nr + nr_idx holds one group,
+             with a selection only the selected rows and columns in the order they were selected
+    """
+    index = CSI_ST_LEN + 2  # starting index
+    if from_file:
+        index = 0  # if reading from a file start at the beginning of given buffer
+
+    field_idx, num_streams, num_tones = csi_field_index(nr * nc, num_tones, streams, tones)
+    words = np.frombuffer(buff, dtype=np.uint16, count=selected_word_count(field_idx), offset=index)
+    fields = extract_csi_fields(words, field_idx)
+    return fields_to_complex(fields, num_streams, num_tones)
+
+
+def decode_CSI_batch(buffers, shapes, from_file=True, streams=None, tones=None):
+    """
+    Decode the CSI of many packets, one vectorized pass for every (nr, nc, num_tones) shape
+    :param buffers: list of csi data buffers, one per packet
+    :param shapes: list of (nr, nc, num_tones) tuples, one per packet
+    :param from_file: reading from a file instead of kernel?
+    :param streams: only decode these streams, see decode_CSI_data
+    :param tones: only decode these sub-carriers, see decode_CSI_data
+    :return: dict mapping (nr, nc, num_tones) to (packet indices, complex array of shape (packets, nr * nc, num_tones)),
+             with a selection the arrays only hold the selected streams and tones the packets of the shape have
+    """
+    index = CSI_ST_LEN + 2  # starting index
+    if from_file:
+        index = 0  # if reading from a file start at the beginning of given buffer
+
+    # bucket the packets by shape so mixed 20/40MHz captures decode without special casing
+    groups = {}
+    for packet_idx, shape in enumerate(shapes):
+        groups.setdefault(tuple(shape), []).append(packet_idx)
+
+    decoded = {}
+    for shape, packet_idxs in groups.items():
+        nr, nc, num_tones = shape
+        field_idx, num_streams, num_selected = csi_field_index(nr * nc, num_tones, streams, tones)
+        num_words = selected_word_count(field_idx)  # words past the last selected field are never read
+
+        words = np.empty((len(packet_idxs), num_words), dtype=np.uint16)
+        for row, packet_idx in enumerate(packet_idxs):
+            words[row] = np.frombuffer(buffers[packet_idx], dtype=np.uint16, count=num_words, offset=index)
+
+        fields = extract_csi_fields(words, field_idx)
+        decoded[shape] = (np.array(packet_idxs, dtype=np.int64), fields_to_complex(fields, num_streams, num_selected))
+    return decoded
+
+
 def dB_per_array(npArray):
     return 20 * np.log10(np.abs(npArray))
 
@@ -222,6 +500,101 @@ def process_CSI_Average_dB(CSI_data_list, average_level):
     return sets_state
 
 
+class QualityWorkspace:
+    """
+    Buffers the batched quality gates compute into, grown on demand and reused, so running the gates chunk after
+    chunk over a whole capture allocates them only once.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def array(self, name, shape, dtype=np.float64):
+        """
+        Buffer of a given shape, its contents are whatever the last user left in it
+        :param name: name of the buffer
+        :param shape: shape needed
+        :param dtype: type of the values
+        :return: numpy array view of the buffer
+        """
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = np.empty(size, dtype=dtype)
+            self.buffers[name] = buffer
+        return buffer[:size].reshape(shape)
+
+
+def magnitude_dB_batch(data, workspace=None):
+    """
+    Magnitude and dB of every tone of every stream and packet, dB_per_array for a whole batch.
+    A tone with zero magnitude is -inf dB like in dB_per_array, without the divide by zero warning
+    :param data: complex numpy array of shape (packets, streams, tones)
+    :param workspace: QualityWorkspace to compute in, the results are views of its buffers
+    :return: (magnitude, dB) float numpy arrays of the same shape as data
+    """
+    workspace = workspace or QualityWorkspace()
+    magnitude = np.abs(data, out=workspace.array("magnitude", data.shape))
+    nonzero = np.greater(magnitude, 0, out=workspace.array("nonzero", data.shape, bool))
+    db = workspace.array("dB", data.shape)
+    db.fill(-np.inf)
+    np.log10(magnitude, out=db, where=nonzero)
+    db *= 20  # -inf stays -inf
+    return magnitude, db
+
+
+def dB_range_mask(db, range_threshold, workspace=None, out=None):
+    """
+    process_CSI for every stream and packet, True where max - min dB over the tones is within range_threshold.
+    A stream with a zero magnitude tone has an infinite range and fails, like in process_CSI
+    :param db: float numpy array of shape (packets, streams, tones) from magnitude_dB_batch
+    :param range_threshold: range in dB
+    :param workspace: QualityWorkspace for the reductions
+    :param out: boolean numpy array of shape (packets, streams) to store the mask in
+    :return: boolean numpy array of shape (packets, streams)
+    """
+    workspace = workspace or QualityWorkspace()
+    db_range = np.max(db, axis=-1, out=workspace.array("max", db.shape[:-1]))
+    db_min = np.min(db, axis=-1, out=workspace.array("min", db.shape[:-1]))
+    with np.errstate(invalid="ignore"):  # -inf - -inf for all zero streams, nan fails the comparison below
+        np.subtract(db_range, db_min, out=db_range)
+    return np.less_equal(db_range, range_threshold, out=out)
+
+
+def mean_level_mask(values, average_level, workspace=None, out=None):
+    """
+    process_CSI_Average_Magnitude or process_CSI_Average_dB for every stream and packet, depending on what is passed
+    :param values: magnitude or dB float numpy array of shape (packets, streams, tones) from magnitude_dB_batch
+    :param average_level: lowest mean over the tones that passes
+    :param workspace: QualityWorkspace for the reduction
+    :param out: boolean numpy array of shape (packets, streams) to store the mask in
+    :return: boolean numpy array of shape (packets, streams)
+    """
+    workspace = workspace or QualityWorkspace()
+    average = np.mean(values, axis=-1, out=workspace.array("mean", values.shape[:-1]))
+    return np.greater_equal(average, average_level, out=out)
+
+
+def quality_masks(data, range_threshold, magnitude_level, db_level, workspace=None):
+    """
+    Run the three quality gates over a batch in one pass, magnitude and dB are computed once for all of them.
+    Combine the masks and reduce over the streams to filter packets, e.g. masks["range"].all(axis=1)
+    :param data: complex numpy array of shape (packets, streams, tones)
+    :param range_threshold: dB range process_CSI allows
+    :param magnitude_level: mean magnitude process_CSI_Average_Magnitude asks for
+    :param db_level: mean dB process_CSI_Average_dB asks for
+    :param workspace: QualityWorkspace to reuse between batches
+    :return: dict with "range", "magnitude" and "dB" boolean numpy arrays of shape (packets, streams)
+    """
+    workspace = workspace or QualityWorkspace()
+    magnitude, db = magnitude_dB_batch(data, workspace)
+    return {
+        "range": dB_range_mask(db, range_threshold, workspace),
+        "magnitude": mean_level_mask(magnitude, magnitude_level, workspace),
+        "dB": mean_level_mask(db, db_level, workspace),
+    }
+
+
 def to_file(opened_file, buffer, buf_len):
     """
     Write information to opened_file
@@ -231,7 +604,7 @@ def to_file(opened_file, buffer, buf_len):
     :param time_stamp: absolute time stamp of received packet
     :return:
     """
-    opened_file.write(struct.pack("=H", buf_len))
+    opened_file.write(TWO_BYTE_STRUCT.pack(buf_len))
 
     opened_file.write(buffer)
 
@@ -242,17 +615,21 @@ def main():
     :return:
     """
 
-    def handler(signal_received, frame):
+    def shutdown():
         """
-        Handles shutdown gracefully when SIGINT or CTRL-C is detected
-        :param signal_received:
-        :param frame:
+        Close everything and report, the log writer writes out every record it still holds
         :return:
         """
         # Handle any cleanup here
         close_csi_device(fd)
         if log_enabled:
-            file_name.close()
+            log_writer.close()
+            print("Records logged:", log_writer.written, "dropped:", log_writer.dropped)
+            if log_writer.error is not None:
+                print("Writing the log failed:", log_writer.error)
+        stats.dump()
+        if stats_file is not None:
+            stats.write_file(stats_file)
         print(" SIGINT or CTRL-C or ALARM detected. Exiting gracefully!")
         print("Packets sent in", SECONDS_TO_RUN, "seconds is: ", packet_count)
         print(
@@ -262,31 +639,212 @@ def main():
         )
         exit(0)
 
+    def handler(signal_received, frame):
+        """
+        Handles shutdown gracefully when SIGINT or CTRL-C is detected
+        :param signal_received:
+        :param frame:
+        :return:
+        """
+        stop.append(signal_received)
+        # a record being queued has to be finished first, the loop shuts down right after it
+        if not queuing_record:
+            shutdown()
+
+    def dump_stats(signal_received, frame):
+        """
+        Print the capture stats when SIGUSR1 is received
+        :param signal_received:
+        :param frame:
+        :return:
+        """
+        stats.dump()
+
+    def handle_record(buff, cnt, read_end_ns):
+        """
+        Answer a ping from bob and log the record, the same for both capture loops
+        :param buff: buffer the record was read into
+        :param cnt: how many bytes were read
+        :param read_end_ns: perf_counter_ns after the read
+        :return:
+        """
+        nonlocal packet_count, queuing_record
+        meta_data, buff_len = record_status(buff, cnt)  # Get meta data of received packet
+
+        # Checks to see if it is most likely the ping from bob
+        if meta_data[14] == PING_PAYLOAD_SIZE:
+            # data = record_CSI_data(  # Get CSI data of received packet
+            #     buff, meta_data[8], meta_data[9], meta_data[7], False
+            # )
+
+            packet_count += 1
+            PACKET_COUNTER_STRUCT.pack_into(send_buff, 0, packet_count)
+            payload_len = pay_file.readinto(payload_view)
+            if payload_len == PACKET_SIZE:
+                send_reply(send_view)
+            else:
+                send_reply(send_view[:COUNTER_SIZE + payload_len])
+            sent_ns = time.perf_counter_ns()
+            stats.sent(read_end_ns, sent_ns)
+
+            if log_enabled:
+                # only this thread sets the flag, the writer thread takes the log writer's lock on its own
+                queuing_record = True
+                log_writer.write(buff, buff_len)  # copied into the writer's blocks, the read buffer can be reused
+                queuing_record = False
+                stats.log_latency.record(time.perf_counter_ns() - sent_ns)
+                if stop:
+                    shutdown()
+
+    def send_reply(reply):
+        """
+        Send a reply, in the event loop a reply the socket can't take yet waits for it to become writable
+        :param reply: bytes-like reply, reused by the caller
+        :return:
+        """
+        if not pending_replies:
+            try:
+                alice_sock.sendto(reply, REPLY_ADDRESS)
+                return
+            except BlockingIOError:
+                selector.modify(alice_sock, selectors.EVENT_WRITE, "reply")
+        pending_replies.append(bytes(reply))
+
+    def run_timers(now_ns):
+        """
+        Run the periodic tasks that are due
+        :param now_ns: perf_counter_ns now
+        :return: perf_counter_ns when the next task is due, None if there are none
+        """
+        next_due = None
+        for timer in timers:
+            if now_ns >= timer[0]:
+                timer[2]()
+                timer[0] = now_ns + timer[1]
+            if next_due is None or timer[0] < next_due:
+                next_due = timer[0]
+        return next_due
+
+    def poll_loop():
+        """
+        Original capture loop, reads the device over and over and acts when a read returned a record
+        :return:
+        """
+        next_due = run_timers(time.perf_counter_ns())
+        while True:
+
+            read_start_ns = time.perf_counter_ns()
+            cnt, buff = read_csi_data(fd, BUFF_SIZE, ring)  # Get buffer from CSI_dev file
+            read_end_ns = time.perf_counter_ns()
+            stats.read(read_start_ns, read_end_ns, cnt)
+
+            if next_due is not None and read_end_ns >= next_due:
+                next_due = run_timers(read_end_ns)
+
+            # Wait until bytes were actually read from buffer
+            if cnt > 0:
+                handle_record(buff, cnt, read_end_ns)
+
+    def event_loop():
+        """
+        Capture loop that sleeps until the device is readable, the reply socket is writable or a timer is due.
+        A device that can't be waited on falls back to poll_loop
+        :return:
+        """
+        try:
+            selector.register(fd, selectors.EVENT_READ, "device")
+        except PermissionError:
+            print("The device doesn't support waiting for records, using the polling loop instead")
+            poll_loop()
+            return
+        # the real device returns 0 bytes when it has no record, only a FIFO, pipe or socket stand in reaches the end
+        fd_mode = os.fstat(fd).st_mode
+        has_end = stat.S_ISFIFO(fd_mode) or stat.S_ISSOCK(fd_mode)
+        os.set_blocking(fd, False)
+        alice_sock.setblocking(False)
+        selector.register(alice_sock, selectors.EVENT_READ, "reply")  # only watched for writing while replies wait
+
+        next_due = run_timers(time.perf_counter_ns())
+        while True:
+            timeout = None
+            if next_due is not None:
+                timeout = max(0.0, (next_due - time.perf_counter_ns()) / 1e9)
+            for key, events in selector.select(timeout):
+                if key.data == "device":
+                    # drain every record that is ready, a read with nothing left raises BlockingIOError
+                    while True:
+                        read_start_ns = time.perf_counter_ns()
+                        try:
+                            cnt, buff = read_csi_data(fd, BUFF_SIZE, ring)
+                        except BlockingIOError:
+                            cnt = -1
+                        read_end_ns = time.perf_counter_ns()
+                        stats.read(read_start_ns, read_end_ns, cnt)
+                        if cnt <= 0:
+                            break
+                        handle_record(buff, cnt, read_end_ns)
+                    if cnt == 0 and has_end:
+                        print("Device closed")
+                        shutdown()
+                elif events & selectors.EVENT_WRITE:
+                    while pending_replies:
+                        try:
+                            alice_sock.sendto(pending_replies[0], REPLY_ADDRESS)
+                        except BlockingIOError:
+                            break
+                        pending_replies.popleft()
+                    if not pending_replies:
+                        selector.modify(alice_sock, selectors.EVENT_READ, "reply")
+                else:
+                    try:
+                        alice_sock.recv(PACKET_SIZE)  # nothing is expected on the reply socket, discard it
+                    except BlockingIOError:
+                        pass
+            if next_due is not None and time.perf_counter_ns() >= next_due:
+                next_due = run_timers(time.perf_counter_ns())
+
+    args, options = CSI_Options.parse_options(
+        sys.argv[1:], {"stats-file": str, "stats-interval": float, "device": str, "event": bool}
+    )
+    if options is None:
+        return
+    stats_file = options.get("stats-file")
+    stats_interval_ns = int(options.get("stats-interval", STATS_INTERVAL) * 1e9)
+
+    stop = []
+    queuing_record = False  # True while handle_record hands a record to the log writer
+    stats = CaptureStats()
     log_enabled = False
     file_name = ""
 
-    if len(sys.argv) == 2:
+    if len(args) == 1:
         try:
             info_file = open("data/info.txt",'r+')
             file_num = int(info_file.read())
             info_file.seek(0)
             info_file.write(str(file_num + 1))
             file_name = open("data/alice" + str(file_num) + ".dat", "wb")
+            log_writer = AsyncLogWriter(
+                file_name, flush_interval=LOG_FLUSH_INTERVAL, drop=LOG_DROP_RECORDS, write_latency=stats.log_write
+            )
         except IOError:
-            print("Couldn't open file: ", sys.argv[1])
+            print("Couldn't open file: ", args[0])
             return
 
         log_enabled = True
         print("Logging enabled, check the data folder for the finished file once program is done")
 
-    if len(sys.argv) > 2:
+    if len(args) > 1:
         print("To many input arguments!")
         return
 
     # Open CSI device and set CTRL-C interrupt and alarm handler
-    fd = open_csi_device()
+    fd = open_csi_device(options.get("device", CSI_DEVICE))
+    if fd is None:
+        return
     signal.signal(signal.SIGINT, handler)
     signal.signal(signal.SIGALRM, handler)
+    signal.signal(signal.SIGUSR1, dump_stats)
     message_count = 1
 
     alice_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -294,35 +852,27 @@ def main():
     packet_count = 0
     average_time = 0
 
+    # periodic tasks as [perf_counter_ns when due, interval in ns, function]
+    timers = []
+    if stats_file is not None:
+        timers.append([stats.started_ns + stats_interval_ns, stats_interval_ns, lambda: stats.write_file(stats_file)])
+
     signal.alarm(SECONDS_TO_RUN)
 
     print("Starting to parse!")
 
-    packet_counter = struct.Struct("=Q")
-
-    while True:
-
-        cnt, buff = read_csi_data(fd, BUFF_SIZE)  # Get buffer from CSI_dev file
-
-        # Wait until bytes were actually read from buffer
-        if cnt > 0:
-            meta_data, buff_len = record_status(buff, cnt)  # Get meta data of received packet
-
-            # Checks to see if it is most likely the ping from bob
-            if meta_data[14] == PING_PAYLOAD_SIZE:
-                # data = record_CSI_data(  # Get CSI data of received packet
-                #     buff, meta_data[8], meta_data[9], meta_data[7], False
-                # )
-
-                packet_count += 1
-                alice_sock.sendto(packet_counter.pack(packet_count) + pay_file.read(1024), ("10.10.0.5", 5005))
-
-                if log_enabled:
-                    to_file(
-                        file_name,
-                        buff[0: buff_len],
-                        buff_len
-                    )
+    # everything the loop reads into or sends from is allocated up front
+    ring = BufferRing()
+    send_buff = bytearray(COUNTER_SIZE + PACKET_SIZE)
+    send_view = memoryview(send_buff)
+    payload_view = send_view[COUNTER_SIZE:]
+    selector = selectors.DefaultSelector()
+    pending_replies = collections.deque()
+
+    if "event" in options:
+        event_loop()
+    else:
+        poll_loop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+import fcntl
+import os
+import shlex
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import termios
+import time
+
+import CSI_Log_Reader
+import CSI_Options
+
+
+TRANSPORTS = ("pipe", "socketpair", "fifo")
+DRAIN_POLL = 0.00005  # seconds between checks that the capture has read the last record from a pipe or FIFO
+CAPTURE_GRACE = 2.0  # seconds the capture gets to exit by itself after the last record before it is interrupted
+FIONREAD_BUFF = struct.Struct("i")
+
+
+def device_frames(reader):
+    """
+    The records of a log framed like /dev/CSI_dev hands them out: the record followed by its buf_len
+    :param reader: CSI_Log_Reader.CSILogReader of the log
+    :return: generator of (TSF, record memoryview, trailing buf_len bytes)
+    """
+    for offset, meta_data, csi_view in reader.records(legacy_cutoff=False):
+        buf_len = reader.read_buf_len(offset)
+        start = offset + CSI_Log_Reader.TWO_BYTE.size
+        yield meta_data[0], reader.view[start:start + buf_len], CSI_Log_Reader.TWO_BYTE.pack(buf_len)
+
+
+class Pacer:
+    """
+    Waits between records so they come out at their original TSF intervals, sped up by a multiplier.
+    A TSF that jumps backwards (the card was reset) restarts the pacing at that record.
+    """
+
+    def __init__(self, speed):
+        """
+        :param speed: multiplier of the original rate, None for as fast as possible
+        """
+        self.speed = speed
+        self.base_tsf = None
+        self.base_time = None
+
+    def wait(self, tsf):
+        """
+        Sleep until the record with this TSF is due
+        :param tsf: TSF of the record in microseconds
+        :return:
+        """
+        if self.speed is None:
+            return
+        now = time.perf_counter()
+        if self.base_tsf is None or tsf < self.base_tsf:
+            self.base_tsf = tsf
+            self.base_time = now
+            return
+        delay = self.base_time + (tsf - self.base_tsf) / 1e6 / self.speed - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def wait_drained(fd):
+    """
+    Wait until the reader of a pipe or FIFO took everything, so every read of the capture gets exactly one record
+    :param fd: write end of the pipe or FIFO
+    :return:
+    """
+    while FIONREAD_BUFF.unpack(fcntl.ioctl(fd, termios.FIONREAD, bytes(FIONREAD_BUFF.size)))[0] > 0:
+        time.sleep(DRAIN_POLL)
+
+
+def replay(log_file, send, pacer, drain_fd=None):
+    """
+    Serve every record of a log
+    :param log_file: CSI log to replay
+    :param send: function that writes one framed record given its parts
+    :param pacer: Pacer
+    :param drain_fd: write end of a pipe or FIFO to wait on after every record, None for a socket
+    :return: (records served, bytes served, seconds taken)
+    """
+    count = 0
+    num_bytes = 0
+    start = time.perf_counter()
+    with CSI_Log_Reader.CSILogReader(log_file) as reader:
+        for tsf, record, trailer in device_frames(reader):
+            pacer.wait(tsf)
+            send([record, trailer])
+            if drain_fd is not None:
+                wait_drained(drain_fd)
+            count += 1
+            num_bytes += len(record) + len(trailer)
+    return count, num_bytes, time.perf_counter() - start
+
+
+def start_capture(command, device, pass_fds=()):
+    """
+    Start the capture reading from the replay
+    :param command: capture command line, --device is added to it
+    :param device: value of --device
+    :param pass_fds: file descriptors the capture inherits
+    :return: subprocess.Popen
+    """
+    return subprocess.Popen(shlex.split(command) + ["--device", device], pass_fds=pass_fds)
+
+
+def stop_capture(capture):
+    """
+    Give the capture time to see the end of the replay and exit, interrupt it like CTRL-C otherwise
+    :param capture: subprocess.Popen of the capture
+    :return: exit code of the capture
+    """
+    try:
+        return capture.wait(CAPTURE_GRACE)
+    except subprocess.TimeoutExpired:
+        capture.send_signal(signal.SIGINT)
+        return capture.wait()
+
+
+def main():
+    args, options = CSI_Options.parse_options(
+        sys.argv[1:], {"transport": str, "fifo": str, "speed": float, "fast": bool, "capture": str}
+    )
+    if options is None:
+        return
+    transport = options.get("transport", "fifo")
+    if len(args) != 1 or transport not in TRANSPORTS or (transport != "fifo" and "capture" not in options):
+        print("python CSI_Replay.py csi_log_file [--transport fifo|pipe|socketpair] [--fifo PATH] "
+              "[--speed X | --fast] [--capture 'python CSI_Python_Parser.py --event']")
+        print("pipe and socketpair need --capture, a fifo can also be read by a capture started separately "
+              "with --device PATH")
+        return
+    pacer = Pacer(None if "fast" in options else options.get("speed", 1.0))
+
+    capture = None
+    try:
+        if transport == "fifo":
+            fifo = options.get("fifo", "CSI_dev.fifo")
+            if not os.path.exists(fifo):
+                os.mkfifo(fifo)
+            if "capture" in options:
+                capture = start_capture(options["capture"], fifo)
+            print("Waiting for the capture to open", fifo)
+            fd = os.open(fifo, os.O_WRONLY)
+            result = replay(args[0], lambda parts: os.writev(fd, parts), pacer, fd)
+            os.close(fd)
+        elif transport == "pipe":
+            read_fd, fd = os.pipe()
+            capture = start_capture(options["capture"], "fd:" + str(read_fd), (read_fd,))
+            os.close(read_fd)
+            result = replay(args[0], lambda parts: os.writev(fd, parts), pacer, fd)
+            os.close(fd)
+        else:
+            # SOCK_SEQPACKET keeps every record a message of its own, no need to wait for the capture to drain
+            replay_sock, capture_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            capture = start_capture(options["capture"], "fd:" + str(capture_sock.fileno()), (capture_sock.fileno(),))
+            capture_sock.close()
+            result = replay(args[0], replay_sock.sendmsg, pacer)
+            replay_sock.close()
+    except IOError as e:
+        print("Replay failed:", e)
+        if capture is not None:
+            stop_capture(capture)
+        return
+
+    count, num_bytes, seconds = result
+    seconds = max(seconds, 1e-9)
+    print("Replayed %d records, %.1f MB in %.2f s, %.0f records/s, %.2f MB/s"
+          % (count, num_bytes / 1e6, seconds, count / seconds, num_bytes / 1e6 / seconds))
+    if capture is not None:
+        print("Capture exited with", stop_capture(capture))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import numpy as np
+
+
+INITIAL_CAPACITY = 64  # packets a duration window holds before its buffers first grow
+
+
+class SlidingWindowStats:
+    """
+    Running mean, variance, max and min of every element of a per packet array, e.g. the CSI magnitude of every
+    (stream, tone), over a sliding window that is either the last window_packets packets or the packets of the last
+    window_us microseconds of TSF. Only the packets inside the window are kept.
+    Every update is a fixed number of vectorized operations over the elements:
+    mean and variance are kept with Welford's update, which also works backwards for the packet leaving the window,
+    max and min with a two stack queue, the vectorizable equivalent of a monotonic deque. The window is split into
+    a front part with precomputed suffix max/min and a back part with a running max/min, and the back part becomes
+    the front when the front runs out, so every packet takes part in one suffix scan: amortized O(1) per element.
+    Feed it packet by packet with add, e.g. from a live capture, or a batch at a time with extend.
+    Attributes:
+        shape           (tuple):        shape of the per packet array
+        window_packets  (int):          number of packets in the window, or None
+        window_us       (int):          TSF duration of the window in microseconds, or None
+        count           (int):          packets in the window now
+    """
+
+    def __init__(self, shape, window_packets=None, window_us=None):
+        """
+        :param shape: shape of the per packet array
+        :param window_packets: window length in packets, at least 1
+        :param window_us: window length in microseconds of TSF, used instead of window_packets, at least 1
+        """
+        if (window_packets is None) == (window_us is None):
+            raise ValueError("give either window_packets or window_us")
+        if (window_packets if window_packets is not None else window_us) <= 0:
+            raise ValueError("the window has to be longer than 0")
+        self.shape = tuple(shape)
+        self.window_packets = window_packets
+        self.window_us = window_us
+        capacity = window_packets + 1 if window_packets is not None else INITIAL_CAPACITY
+
+        self.values = np.empty((capacity,) + self.shape)
+        self.suffix_max = np.empty_like(self.values)
+        self.suffix_min = np.empty_like(self.values)
+        self.tsf = np.zeros(capacity, dtype=np.int64)
+        self.head = 0  # ring position of the oldest packet
+        self.count = 0
+        self.front = 0  # packets from head on whose suffix max/min are valid
+
+        self.back_max = np.empty(self.shape)
+        self.back_min = np.empty(self.shape)
+        self._mean = np.zeros(self.shape)
+        self._m2 = np.zeros(self.shape)
+        self._delta = np.empty(self.shape)
+        self._step = np.empty(self.shape)
+
+    def add(self, values, tsf=0):
+        """
+        Add a packet and drop the packets that fell out of the window
+        :param values: numpy array of the window's shape
+        :param tsf: TSF of the packet in microseconds, only needed for a duration window
+        :return:
+        """
+        self.push(values, tsf)
+        if self.window_packets is not None:
+            if self.count > self.window_packets:
+                self.pop()
+        else:
+            while self.tsf[self.head] <= tsf - self.window_us:
+                self.pop()
+
+    def extend(self, values, tsfs=None, out=None):
+        """
+        Add packets one after the other and collect the stats of the window after each of them
+        :param values: numpy array of shape (packets,) + shape
+        :param tsfs: TSF of every packet, only needed for a duration window
+        :param out: float numpy array of shape (packets, 4) + shape to store the stats in
+        :return: numpy array of shape (packets, 4) + shape, see stats
+        """
+        if out is None:
+            out = np.empty((len(values), 4) + self.shape)
+        for packet_idx in range(len(values)):
+            self.add(values[packet_idx], 0 if tsfs is None else int(tsfs[packet_idx]))
+            self.stats(out[packet_idx])
+        return out
+
+    def push(self, values, tsf):
+        if self.count == len(self.values):
+            self.grow()
+        pos = (self.head + self.count) % len(self.values)
+        self.values[pos] = values
+        self.tsf[pos] = tsf
+        if self.count == self.front:  # back part was empty
+            self.back_max[...] = values
+            self.back_min[...] = values
+        else:
+            np.maximum(self.back_max, values, out=self.back_max)
+            np.minimum(self.back_min, values, out=self.back_min)
+
+        self.count += 1
+        np.subtract(values, self._mean, out=self._delta)
+        np.divide(self._delta, self.count, out=self._step)
+        self._mean += self._step
+        np.subtract(values, self._mean, out=self._step)
+        self._delta *= self._step
+        self._m2 += self._delta
+
+    def pop(self):
+        if self.front == 0:
+            self.flip()
+        values = self.values[self.head]
+        self.head = (self.head + 1) % len(self.values)
+        self.front -= 1
+        self.count -= 1
+        if self.count == 0:
+            self._mean.fill(0)
+            self._m2.fill(0)
+            return
+
+        # Welford's update run backwards
+        np.subtract(values, self._mean, out=self._delta)
+        np.divide(self._delta, self.count, out=self._step)
+        self._mean -= self._step
+        np.subtract(values, self._mean, out=self._step)
+        self._delta *= self._step
+        self._m2 -= self._delta
+
+    def flip(self):
+        """
+        Turn the back part into the front part by computing its suffix max and min
+        :return:
+        """
+        positions = (self.head + np.arange(self.count)) % len(self.values)
+        segment = self.values[positions][::-1]
+        self.suffix_max[positions] = np.maximum.accumulate(segment, axis=0)[::-1]
+        self.suffix_min[positions] = np.minimum.accumulate(segment, axis=0)[::-1]
+        self.front = self.count
+
+    def grow(self):
+        """
+        Double the buffers of a duration window, the ring is unrolled so the oldest packet is at 0 again
+        :return:
+        """
+        positions = (self.head + np.arange(self.count)) % len(self.values)
+        capacity = 2 * len(self.values)
+        for name in ("values", "suffix_max", "suffix_min", "tsf"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[positions]
+            setattr(self, name, new)
+        self.head = 0
+
+    @property
+    def mean(self):
+        return self._mean.copy()
+
+    @property
+    def variance(self):
+        """
+        Population variance like np.var, rounding can take an exact zero a hair below it so it is clipped
+        """
+        if self.count == 0:
+            return np.zeros(self.shape)
+        return np.maximum(self._m2 / self.count, 0)
+
+    @property
+    def max(self):
+        return self.window_extreme(self.suffix_max, self.back_max, np.maximum)
+
+    @property
+    def min(self):
+        return self.window_extreme(self.suffix_min, self.back_min, np.minimum)
+
+    def window_extreme(self, suffix, back, combine, out=None):
+        if self.count == 0:
+            raise ValueError("the window is empty")
+        if self.front == 0:
+            source = back
+        elif self.front == self.count:
+            source = suffix[self.head]
+        else:
+            return combine(suffix[self.head], back, out=out)
+        if out is None:
+            return source.copy()
+        np.copyto(out, source)
+        return out
+
+    def stats(self, out=None):
+        """
+        Stats of the window now
+        :param out: float numpy array of shape (4,) + shape to store them in
+        :return: numpy array of shape (4,) + shape holding mean, variance, max and min
+        """
+        if out is None:
+            out = np.empty((4,) + self.shape)
+        out[0] = self._mean
+        np.divide(self._m2, max(self.count, 1), out=out[1])
+        np.maximum(out[1], 0, out=out[1])
+        self.window_extreme(self.suffix_max, self.back_max, np.maximum, out[2])
+        self.window_extreme(self.suffix_min, self.back_min, np.minimum, out[3])
+        return out
@@ -0,0 +1,221 @@
+import concurrent.futures
+import csv
+import glob
+import os
+import re
+import shutil
+import sys
+import time
+
+import CSI_Options
+import data_compile
+
+
+def read_manifest(manifest_file):
+    """
+    Read the runs to compile from a manifest csv with one log_file,bob_csv,eve_csv line per run, # starts a comment
+    :param manifest_file: path of the manifest
+    :return: list of (log_file, bob_csv, eve_csv)
+    """
+    runs = []
+    with open(manifest_file, 'r') as f:
+        for row in csv.reader(f, delimiter=","):
+            if not row or row[0].strip().startswith('#'):
+                continue
+            if len(row) < 3:
+                print("Skipping incomplete manifest line:", ','.join(row))
+                continue
+            runs.append(tuple(cell.strip() for cell in row[:3]))
+    return runs
+
+
+def glob_runs(pattern, bob_template, eve_template):
+    """
+    Find the runs to compile with a glob over the logs, bob and eve csvs are named from templates.
+    A template can use {dir} (directory of the log), {stem} (log name without extension) and {n} (last number in
+    the log name, e.g. 7 for data/alice7.dat)
+    :param pattern: glob of the log files
+    :param bob_template: name of the bob csv of a log, e.g. {dir}/bob{n}.csv
+    :param eve_template: name of the eve csv of a log, e.g. {dir}/eve{n}.csv
+    :return: list of (log_file, bob_csv, eve_csv) sorted by run number
+    """
+    runs = []
+    for log_file in glob.glob(pattern):
+        stem = os.path.splitext(os.path.basename(log_file))[0]
+        numbers = re.findall(r'\d+', stem)
+        fields = {"dir": os.path.dirname(log_file) or '.', "stem": stem, "n": numbers[-1] if numbers else ''}
+        runs.append((int(fields["n"]) if fields["n"] else -1, log_file,
+                     bob_template.format(**fields), eve_template.format(**fields)))
+    runs.sort()
+    return [(log_file, bob_csv, eve_csv) for run_num, log_file, bob_csv, eve_csv in runs]
+
+
+def compile_run(log_file, bob_csv, eve_csv, mode, num_groupings, output, write_header, resume=None):
+    """
+    Worker of batch_compile, compile one run
+    :param log_file: log binary file that contains CSI info
+    :param bob_csv: csv file that contains the sequence numbers that bob collected
+    :param eve_csv: csv file that contains the sequence numbers that eve collected
+    :param mode: compile mode, a key of data_compile.COMPILE_MODES
+    :param num_groupings: number of csi groups to include
+    :param output: output file of the run
+    :param write_header: False writes only the rows of a csv mode, for merging. Otherwise the append modes resume
+                         from a checkpoint next to the output like data_compile does, a rerun adds no duplicate rows
+    :param resume: where to start a merged part, from the checkpoint of the merged output, None for the beginning
+    :return: dict with the log size, rows written, seconds taken, an error message or None and the offset, cursor
+             and next_packet the compile stopped at
+    """
+    start = time.perf_counter()
+    result = {"log": log_file, "output": output, "bytes": 0, "rows": 0, "seconds": 0.0, "error": None, "state": None}
+    try:
+        result["bytes"] = os.stat(log_file).st_size
+        checkpoint = None
+        if write_header:
+            sink = data_compile.make_sink(mode, num_groupings, output)
+            if data_compile.COMPILE_MODES[mode][3] == 'a':
+                checkpoint = data_compile.checkpoint_file_name(output)
+        else:
+            sink_class, features = data_compile.COMPILE_MODES[mode][:2]
+            sink = sink_class(output, num_groupings, features, None, 'w')
+        result["state"] = data_compile.compile_log(log_file, bob_csv, eve_csv, sink, checkpoint=checkpoint, start=resume)
+        result["rows"] = sink.num_rows
+    except (IOError, SystemExit) as e:
+        result["error"] = str(e) or "couldn't open file"
+    except Exception as e:  # a broken log fails its own run, not the batch
+        result["error"] = type(e).__name__ + ": " + str(e)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def report(result):
+    """
+    Print the throughput of one run
+    :param result: dict from compile_run
+    :return:
+    """
+    if result["error"] is not None:
+        print("FAILED ", result["log"], ":", result["error"])
+        return
+    seconds = max(result["seconds"], 1e-9)
+    print(
+        "%-40s %10.1f MB %9d rows %8.2f s %8.1f MB/s %10.0f rows/s"
+        % (result["log"], result["bytes"] / 1e6, result["rows"], result["seconds"],
+           result["bytes"] / 1e6 / seconds, result["rows"] / seconds)
+    )
+
+
+def batch_compile(runs, num_groupings, mode, out_dir=None, merged=None, workers=1):
+    """
+    Compile many runs on a process pool, either into one output per run or into one merged csv in run order
+    :param runs: list of (log_file, bob_csv, eve_csv)
+    :param num_groupings: number of csi groups to include
+    :param mode: compile mode, a key of data_compile.COMPILE_MODES
+    :param out_dir: directory for the per-run outputs, named after the logs
+    :param merged: merged output csv, modes 1 and 2 start it with a header, modes 3 and 4 append to it and resume
+                   every log from the merged output's checkpoint, so a rerun adds no duplicate rows
+    :param workers: number of worker processes
+    :return: list of result dicts from compile_run, in run order
+    """
+    sink_class, features, header, option = data_compile.COMPILE_MODES[mode]
+    if merged is not None and not issubclass(sink_class, data_compile.CsvSink):
+        print("Merged output needs a csv mode (1 to 4 or 7)")
+        return []
+
+    outputs = []
+    for run_num, (log_file, bob_csv, eve_csv) in enumerate(runs):
+        if merged is not None:
+            outputs.append(merged + ".part" + str(run_num))
+        else:
+            stem = os.path.splitext(os.path.basename(log_file))[0]
+            outputs.append(os.path.join(out_dir, stem + (".csv" if issubclass(sink_class, data_compile.CsvSink) else "")))
+
+    # logs with the same name in different directories would write the same per-run output
+    first_run = {}
+    for (log_file, bob_csv, eve_csv), output in zip(runs, outputs):
+        if os.path.abspath(output) in first_run:
+            print("Runs", first_run[os.path.abspath(output)], "and", log_file, "would both write", output
+                  + ", rename one of the logs or use --merged")
+            return []
+        first_run[os.path.abspath(output)] = log_file
+
+    checkpoint = None
+    resumes = [None] * len(runs)
+    if merged is not None and option == 'a':
+        checkpoint = data_compile.checkpoint_file_name(merged)
+        resumes = [data_compile.load_checkpoint(checkpoint, log_file, merged) for log_file, bob_csv, eve_csv in runs]
+
+    total_start = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(compile_run, log_file, bob_csv, eve_csv, mode, num_groupings, output, merged is None, resume)
+            for (log_file, bob_csv, eve_csv), output, resume in zip(runs, outputs, resumes)
+        ]
+        for future in futures:  # report in run order
+            results.append(future.result())
+            report(results[-1])
+
+    if merged is not None:
+        if option == 'w' and os.path.exists(data_compile.checkpoint_file_name(merged)):
+            os.remove(data_compile.checkpoint_file_name(merged))
+        with open(merged, option) as output:
+            if option == 'w':
+                output.write(header(num_groupings))
+            for result in results:
+                if result["error"] is None:
+                    with open(result["output"], 'r') as part:
+                        shutil.copyfileobj(part, output)
+                    if checkpoint is not None:
+                        output.flush()
+                        state = result["state"]
+                        data_compile.save_checkpoint(checkpoint, result["log"], merged, state["offset"], state["cursor"],
+                                                     state["next_packet"])
+                if os.path.exists(result["output"]):
+                    os.remove(result["output"])
+
+    total_seconds = max(time.perf_counter() - total_start, 1e-9)
+    total_bytes = sum(result["bytes"] for result in results)
+    print("Compiled", len(results), "runs,", "%.1f MB in %.2f s, %.1f MB/s" % (total_bytes / 1e6, total_seconds, total_bytes / 1e6 / total_seconds))
+    return results
+
+
+def main():
+    args, options = CSI_Options.parse_options(
+        sys.argv[1:],
+        {"manifest": str, "glob": str, "bob": str, "eve": str, "out-dir": str, "merged": str, "workers": int},
+    )
+    if options is None:
+        return
+    if len(args) != 2 or ("manifest" in options) == ("glob" in options) or ("out-dir" in options) == ("merged" in options):
+        print("python batch_compile.py num_groupings mode (--manifest runs.csv | --glob 'data/alice*.dat' "
+              "--bob '{dir}/bob{n}.csv' --eve '{dir}/eve{n}.csv') (--out-dir DIR | --merged output.csv) [--workers N]")
+        return
+    if args[1] not in data_compile.COMPILE_MODES:
+        print("Wrong type of mode was provided")
+        return
+
+    if "manifest" in options:
+        try:
+            runs = read_manifest(options["manifest"])
+        except IOError:
+            print("Couldn't open manifest file!")
+            return
+    else:
+        if "bob" not in options or "eve" not in options:
+            print("--glob needs --bob and --eve templates")
+            return
+        runs = glob_runs(options["glob"], options["bob"], options["eve"])
+
+    if not runs:
+        print("No runs to compile")
+        return
+    if "out-dir" in options:
+        os.makedirs(options["out-dir"], exist_ok=True)
+
+    batch_compile(runs, int(args[0]), args[1], options.get("out-dir"), options.get("merged"),
+                  options.get("workers", os.cpu_count() or 1))
+    print("Done")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,88 @@
+import CSI_Cache
 import CSI_Class
+import CSI_Log_Index
+import CSI_Log_Reader
+import CSI_Options
 import CSI_Python_Parser
-import struct
-import os
+import CSI_Stats
 import sys
 import numpy as np
 import csv
-
-
-def parse_info(file_name):
+import concurrent.futures
+import hashlib
+import json
+import os
+import signal
+import time
+
+
+CHUNK_SIZE = 4096  # packets decoded in one batch by the compile pipeline
+BLOCK_ROWS = 4096  # csv rows formatted and written at once
+RANGES_PER_WORKER = 4  # byte ranges per worker process when compiling in parallel
+CHECKPOINT_SUFFIX = ".ckpt"  # append compiles keep their progress next to the output as <output>.ckpt
+CHECKPOINT_FINGERPRINT = 4096  # log bytes before the checkpoint offset that are hashed to recognize the log
+FOLLOW_INTERVAL = 1.0  # seconds between polls of a log that is being followed
+WINDOW_PACKETS = 100  # packets in the sliding window of mode 7 unless a window is given
+NUM_TONES = 56  # tones of a 20MHz packet, the magnitude outputs keep the first NUM_TONES unless tones are selected
+
+# command line options that filter packets on their status header, option to (META_DTYPE field, bound it sets)
+FILTER_OPTIONS = {
+    "channel": ("channel", "both"),
+    "chan-bw": ("chan_bw", "both"),
+    "phyerr": ("phyerr", "both"),
+    "nr": ("nr", "both"),
+    "nc": ("nc", "both"),
+    "payload-len": ("payload_len", "both"),
+    "min-rssi": ("rssi", "low"),
+    "max-rssi": ("rssi", "high"),
+    "min-tsf": ("tfs_stamp", "low"),
+    "max-tsf": ("tfs_stamp", "high"),
+}
+
+
+def parse_info(file_name, columnar=False, compact=False, lazy=False):
     """
     Open the CSI log file and read the data from it into a list of objects
     :param file_name: name of the file to be opened and read
-    :return: List of CSI objects
+    :param columnar: return a CSI_Class.CSIArray instead of a list of CSI objects
+    :param compact: with columnar, store the csi data as int16 pairs instead of complex
+    :param lazy: don't decode any CSI, every object keeps a view of its raw csi bytes in the log's map and decodes
+                 it the first time its data is read. The map stays open as long as an undecoded object is alive.
+                 Ignored with columnar
+    :return: List of CSI objects, or a CSIArray
     """
 
     # try to open the file, if it fails exit the program
     try:
-        f = open(file_name, "rb")
+        reader = CSI_Log_Reader.CSILogReader(file_name)
     except IOError:
         print("Couldn't open file!")
         sys.exit()
 
-    # get the length of the entire file
-    len_of_file = os.stat(file_name).st_size
-
     csi_packet_info = []
-    cur = 0
-
-    one_byte = struct.Struct("=B")
-    two_byte = struct.Struct("=H")
-    meta_struct = struct.Struct('=QHHBBBBBBBBBBBH')
+    meta_rows = []
+    num_packets = 0
+    csi_idxs = []
+    csi_buffs = []
+    csi_shapes = []
 
-    while cur < (len_of_file - 4):  # loop until the end of the file is reached
+    for offset, meta_data, csi_buff in reader.records():  # loop until the end of the file is reached
 
-        cur_csi_obj = CSI_Class.CSI()  # Create new CSI obj to fill
+        # Check to see if there is any CSI data and if so keep a view of it, decoded below in one batch
+        if meta_data[1] > 0 and (columnar or not lazy):
+            csi_idxs.append(num_packets)
+            csi_buffs.append(csi_buff)
+            csi_shapes.append((meta_data[8], meta_data[9], meta_data[7]))
 
-        # read all the meta data from the current
-        cur_csi_obj.buf_len = two_byte.unpack(f.read(2))[0]
+        num_packets += 1
+        if columnar:
+            meta_rows.append((reader.read_buf_len(offset),) + meta_data)
+            continue
 
-        # time_stamp = f.read(26)
-        # cur_csi_obj.time_stamp = time_stamp.decode("utf-8")
+        cur_csi_obj = CSI_Class.CSI()  # Create new CSI obj to fill
 
-        meta_data = meta_struct.unpack(f.read(25))
+        # fill all the meta data from the current record
+        cur_csi_obj.buf_len = reader.read_buf_len(offset)
         cur_csi_obj.tfs_stamp = meta_data[0]
         cur_csi_obj.csi_len = meta_data[1]
         cur_csi_obj.channel = meta_data[2]
@@ -57,281 +98,900 @@ def parse_info(file_name):
         cur_csi_obj.rssi_1 = meta_data[12]
         cur_csi_obj.rssi_2 = meta_data[13]
         cur_csi_obj.payload_len = meta_data[14]
-
-        cur += 53
-
-        # Check to see if there is any CSI data and if so read it from the file
-        if cur_csi_obj.csi_len > 0:
-            csi_buff = bytearray(f.read(cur_csi_obj.csi_len))
-            cur_csi_obj.data = CSI_Python_Parser.record_CSI_data(
-                csi_buff, cur_csi_obj.nr, cur_csi_obj.nc, cur_csi_obj.num_tones, True
-            )
-            cur += cur_csi_obj.csi_len
-
-        # implement payload processing if needed, else just going to skip those bytes
-        cur += cur_csi_obj.payload_len
-        f.read(cur_csi_obj.payload_len)
+        if lazy and meta_data[1] > 0:
+            cur_csi_obj.csi_buff = csi_buff
 
         # Create a list of CSI packets
         csi_packet_info.append(cur_csi_obj)
 
-        if cur + 420 > len_of_file:
-            break
+    # decoded groups index into the packets that have csi, map them back to packet indices
+    csi_idxs = np.array(csi_idxs, dtype=np.int64)
+    decoded = CSI_Python_Parser.decode_CSI_batch(csi_buffs, csi_shapes, True)
+    decoded = {shape: (csi_idxs[packet_idxs], data) for shape, (packet_idxs, data) in decoded.items()}
+    csi_buffs = None
+    reader.close()
+
+    if columnar:
+        return CSI_Class.CSIArray.from_decoded(np.array(meta_rows, dtype=CSI_Class.META_DTYPE), decoded, compact)
+
+    # each object gets a view into the array of its shape group
+    for packet_idxs, data in decoded.values():
+        for row, packet_idx in enumerate(packet_idxs):
+            csi_packet_info[packet_idx].data = data[row]
     return csi_packet_info
 
 
-def parse_and_data_compile_mag(csi_log_file, num_groupings, bob_csv, eve_csv, output_csv):
+class PacketChunk:
     """
-    Open the CSI log file and both Bob and Eve csv files and parse them into a data csv file
-    :param csi_log_file: log binary file that contains CSI info
-    :param num_groupings: number of csi groups to include in output csv file
-    :param bob_csv: csv file that contains the sequence numbers that bob collected
-    :param eve_csv: csv file that contains the sequence numbers that eve collected
-    :param output_csv: output csv that data is written to
-    :return: nothing to return but check info in output csv
+    A chunk of decoded packets that have CSI, in log order.
+    Attributes:
+        packet_nums (numpy array):  packet number of every packet, the sequence numbers used for bob and eve
+        meta        (numpy array):  structured array of CSI_Class.META_DTYPE, one row per packet
+        groups      (dict):         (nr, nc, num_tones) to (rows into packet_nums, complex array (packets, nr * nc, num_tones))
+        end_offset  (int):          byte offset of the record after the chunk's last packet, None if not read from a log
+        end_cursor  (int):          the original loops' cur at end_offset
+        next_packet (int):          packet number of the first packet after the chunk, filtered out packets included
     """
 
-    # try to open the file, if it fails exit the program
-    try:
-        f = open(csi_log_file, "rb")
-    except IOError:
-        print("Couldn't open file!")
-        sys.exit()
+    def __init__(self, packet_nums, meta, groups, end_offset=None, end_cursor=None, next_packet=None):
+        self.packet_nums = packet_nums
+        self.meta = meta
+        self.groups = groups
+        self.end_offset = end_offset
+        self.end_cursor = end_cursor
+        if next_packet is None and len(packet_nums) > 0:
+            next_packet = int(packet_nums[-1]) + 1
+        self.next_packet = next_packet
 
-    # Open output csv and populate the headers
-    output = open(output_csv, 'w')
-    for x in range(56 * num_groupings):
-        output.write(str(int(x / 56)) + '-' + str(x % 56) + ',')
-    output.write('Victory\n')
+    def __len__(self):
+        return len(self.packet_nums)
 
-    # get the length of the entire file
-    len_of_file = os.stat(csi_log_file).st_size
-    bob, eve = process_bob_eve(bob_csv, eve_csv)
-    num_packets = 1
-    cur = 0
-
-    # Init the binary to ascii objects
-    two_byte = struct.Struct("=H")
-    meta_struct = struct.Struct('=QHHBBBBBBBBBBBH')
-
-    while cur < (len_of_file - 4):  # loop until the end of the file is reached
-
-        # read all the meta data from the current
-        buf_len = two_byte.unpack(f.read(2))[0]
-
-        # Grab the meta from the binary file
-        meta_data = meta_struct.unpack(f.read(25))
-        # cur_csi_obj.tfs_stamp = meta_data[0]
-        # cur_csi_obj.csi_len = meta_data[1]
-        # cur_csi_obj.channel = meta_data[2]
-        # cur_csi_obj.phyerr = meta_data[3]
-        # cur_csi_obj.noise = meta_data[4]
-        # cur_csi_obj.rate = meta_data[5]
-        # cur_csi_obj.chan_bw = meta_data[6]
-        # cur_csi_obj.num_tones = meta_data[7]
-        # cur_csi_obj.nr = meta_data[8]
-        # cur_csi_obj.nc = meta_data[9]
-        # cur_csi_obj.rssi = meta_data[10]
-        # cur_csi_obj.rssi_0 = meta_data[11]
-        # cur_csi_obj.rssi_1 = meta_data[12]
-        # cur_csi_obj.rssi_2 = meta_data[13]
-        # cur_csi_obj.payload_len = meta_data[14]
-
-        cur += 53
-
-        # Check to see if there is any CSI data and if so read it from the file and put it on the output csv file
+
+def read_packet_chunks(reader, chunk_size=CHUNK_SIZE, offset=0, end=None, first_packet=1, cursor=None,
+                       header_filter=None, streams=None, tones=None):
+    """
+    Record source of the compile pipeline, decodes the packets with CSI a chunk at a time
+    :param reader: CSI_Log_Reader.CSILogReader of the log
+    :param chunk_size: number of packets to decode in one batch
+    :param offset: byte offset of the first record
+    :param end: byte offset of the first record not to read, None reads up to the original cut-off
+    :param first_packet: packet number of the first packet with CSI at offset
+    :param cursor: the original loops' cur at offset, needed to resume up to the original cut-off
+    :param header_filter: dict for header_mask, packets it rejects are dropped before their CSI is decoded but
+                          still use up their packet number. A chunk may end up with no packets at all
+    :param streams: indices of the streams to decode, None for all, see CSI_Python_Parser.decode_CSI_data
+    :param tones: indices of the sub-carriers to decode, None for all
+    :return: generator of PacketChunk
+    """
+    if cursor is None:
+        cursor = offset
+    packet_num = first_packet
+    packet_nums = []
+    meta_rows = []
+    csi_buffs = []
+    csi_shapes = []
+
+    records = reader.records(offset, legacy_cutoff=end is None, cursor=cursor, end=end)
+    for offset, meta_data, csi_buff in records:  # loop until the end of the file is reached
+        cursor += CSI_Log_Reader.LEGACY_RECORD_LEN + meta_data[1] + meta_data[14]
+
+        # only packets with CSI get a packet number, payload processing can be implemented here if needed
         if meta_data[1] > 0:
-            csi_buff = bytearray(f.read(meta_data[1]))
-            data = CSI_Python_Parser.record_CSI_data(
-                csi_buff, meta_data[8], meta_data[9], meta_data[7], True
-            )
-            cur += meta_data[1]
+            packet_nums.append(packet_num)
+            meta_rows.append((reader.read_buf_len(offset),) + meta_data)
+            csi_buffs.append(csi_buff)
+            csi_shapes.append((meta_data[8], meta_data[9], meta_data[7]))
+            packet_num += 1
+            end_offset = offset + CSI_Log_Reader.RECORD_HEADER_LEN + meta_data[1] + meta_data[14]
+            end_cursor = cursor
+
+            if len(packet_nums) == chunk_size:
+                yield make_packet_chunk(packet_nums, meta_rows, csi_buffs, csi_shapes, end_offset, end_cursor,
+                                        header_filter, streams, tones)
+                packet_nums, meta_rows, csi_buffs, csi_shapes = [], [], [], []
+
+    if packet_nums:
+        yield make_packet_chunk(packet_nums, meta_rows, csi_buffs, csi_shapes, end_offset, end_cursor, header_filter,
+                                streams, tones)
+
+
+def make_packet_chunk(packet_nums, meta_rows, csi_buffs, csi_shapes, end_offset=None, end_cursor=None,
+                      header_filter=None, streams=None, tones=None):
+    """
+    Batch decode the collected packets into a PacketChunk
+    :param packet_nums: list of packet numbers
+    :param meta_rows: list of (buf_len,) + status header tuples
+    :param csi_buffs: list of csi data buffers
+    :param csi_shapes: list of (nr, nc, num_tones) tuples
+    :param end_offset: byte offset of the record after the last packet
+    :param end_cursor: the original loops' cur at end_offset
+    :param header_filter: dict for header_mask, only the packets it keeps are decoded
+    :param streams: indices of the streams to decode, None for all
+    :param tones: indices of the sub-carriers to decode, None for all
+    :return: PacketChunk
+    """
+    packet_nums = np.array(packet_nums, dtype=np.int64)
+    meta = np.array(meta_rows, dtype=CSI_Class.META_DTYPE)
+    next_packet = int(packet_nums[-1]) + 1
+    if header_filter:
+        keep = np.flatnonzero(header_mask(meta, header_filter))
+        packet_nums = packet_nums[keep]
+        meta = meta[keep]
+        csi_buffs = [csi_buffs[packet_idx] for packet_idx in keep]
+        csi_shapes = [csi_shapes[packet_idx] for packet_idx in keep]
+    return PacketChunk(
+        packet_nums,
+        meta,
+        CSI_Python_Parser.decode_CSI_batch(csi_buffs, csi_shapes, True, streams, tones),
+        end_offset,
+        end_cursor,
+        next_packet,
+    )
+
+
+def header_mask(meta, header_filter):
+    """
+    Evaluate a filter on the status headers of many packets at once
+    :param meta: structured array of CSI_Class.META_DTYPE
+    :param header_filter: dict of META_DTYPE field to an inclusive (low, high) range, None for an open end
+    :return: bool numpy array, True for the packets that pass
+    """
+    mask = np.ones(len(meta), dtype=bool)
+    for field, (low, high) in header_filter.items():
+        if low is not None:
+            mask &= meta[field] >= low
+        if high is not None:
+            mask &= meta[field] <= high
+    return mask
 
-            if len(data) == num_groupings:
-                victory_score = bobVsEve(bob, eve, num_packets)
-                add_data_csv(data, output, num_groupings, victory_score)
 
-            num_packets += 1
+def header_filter_from_options(options):
+    """
+    Build the header filter of the FILTER_OPTIONS given on the command line
+    :param options: dict from CSI_Options.parse_options
+    :return: dict for header_mask, None if no filter option was given
+    """
+    header_filter = {}
+    for name, (field, bound) in FILTER_OPTIONS.items():
+        if name in options:
+            low, high = header_filter.get(field, (None, None))
+            if bound != "high":
+                low = options[name]
+            if bound != "low":
+                high = options[name]
+            header_filter[field] = (low, high)
+    return header_filter or None
+
+
+class CsvBlockWriter:
+    """
+    Collects csv rows into blocks of integers and formats each block at once, large blocks in parallel chunks.
+    Attributes:
+        csv_file    (file): output csv file to write to
+        block_rows  (int):  number of rows collected before a block is formatted and written
+        workers     (int):  number of processes that format a block, 1 formats in this process
+    """
 
-        # implement payload processing if needed, else just going to skip those bytes
-        cur += meta_data[14]
-        f.read(meta_data[14])
+    def __init__(self, csv_file, block_rows=BLOCK_ROWS, workers=1):
+        self.csv_file = csv_file
+        self.block_rows = block_rows
+        self.workers = workers
+        self.pending = []
+        self.pending_rows = 0
+        self.executor = None
+
+    def add(self, rows):
+        """
+        Queue rows for writing
+        :param rows: 2-D integer numpy array, one csv row per array row
+        :return:
+        """
+        self.pending.append(rows)
+        self.pending_rows += len(rows)
+        if self.pending_rows >= self.block_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Format the queued rows and write them with one write call
+        :return:
+        """
+        if not self.pending:
+            return
+        block = np.concatenate(self.pending)
+        self.pending = []
+        self.pending_rows = 0
+
+        if self.workers > 1 and len(block) >= self.block_rows:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+            text = ''.join(self.executor.map(format_rows, np.array_split(block, self.workers)))
+        else:
+            text = format_rows(block)
+        self.csv_file.write(text)
+
+    def close(self):
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class CsvSink:
+    """
+    Sink of the compile pipeline, writes one csv row for every packet that has num_groupings groups of CSI.
+    With a stream selection the groups are the selected streams the packet has, with a tone selection only packets
+    that have every selected tone get a row.
+    Attributes:
+        output_csv      (str):          output csv that data is written to
+        num_groupings   (int):          number of csi groups to include in the output csv file
+        features        (function):     mag_features or other_features
+        header          (function):     mag_header or other_header, None when appending
+        mode            (str):          file mode of the output csv, 'w' or 'a'
+        workers         (int):          number of processes that format large blocks
+        streams         (numpy array):  indices of the streams to decode, None for all
+        tones           (numpy array):  indices of the sub-carriers to decode, None for all
+        num_tones       (int):          number of selected tones, None without a tone selection
+        num_rows        (int):          rows written so far
+    """
 
+    def __init__(self, output_csv, num_groupings, features, header, mode, workers=1, streams=None, tones=None):
+        self.output_csv = output_csv
+        self.num_groupings = num_groupings
+        self.features = features
+        self.header = header
+        self.mode = mode
+        self.workers = workers
+        self.streams = streams
+        self.tones = tones
+        self.num_tones = None if tones is None else len(tones)
+        self.num_rows = 0
+        self.output = None
+        self.writer = None
+
+    def open(self):
+        if self.mode == 'w':
+            # the rows an append compile checkpointed are gone once the output is rewritten
+            try:
+                os.remove(checkpoint_file_name(self.output_csv))
+            except FileNotFoundError:
+                pass
+        self.output = open(self.output_csv, self.mode)
+        if self.header is not None:
+            self.output.write(self.header(self.num_groupings, self.num_tones))
+        self.writer = CsvBlockWriter(self.output, workers=self.workers)
+
+    def write(self, chunk, labels):
+        """
+        Add the rows of a chunk
+        :param chunk: PacketChunk
+        :param labels: victory label of every packet in the chunk
+        :return:
+        """
+        rows = packet_rows(chunk, labels, self.features, self.num_groupings, self.num_tones)
+        if rows is not None:
+            self.write_rows(rows)
+
+    def write_rows(self, rows):
+        """
+        Add rows that were already extracted, the label is the last column
+        :param rows: 2-D integer numpy array
+        :return:
+        """
+        self.num_rows += len(rows)
+        self.writer.add(rows)
+
+    def write_text(self, text):
+        """
+        Add rows that were already formatted with format_rows
+        :param text: csv text
+        :return:
+        """
+        self.num_rows += text.count('\n')
+        self.writer.flush()
+        self.output.write(text)
+
+    def flush(self):
+        """
+        Push every row added so far to the output file
+        :return:
+        """
+        self.writer.flush()
+        self.output.flush()
+
+    def close(self):
+        self.writer.close()
+        self.output.close()
+
+
+class WindowStatsSink(CsvSink):
+    """
+    Sink of compile mode 7, writes one csv row for every packet that has num_groupings groups of CSI with the mean,
+    variance, max and min of every tone of every group over a sliding window of the packets up to and including it.
+    The window runs through the packets in log order, so the sink sees every chunk of a log one after the other.
+    Attributes:
+        stats   (CSI_Stats.SlidingWindowStats):     window over the values of the packets, shape (num_groupings, tones)
+    """
 
-        if cur + 420 > len_of_file:
-            break
-    output.close()
-    print("Finished parsing")
+    def __init__(self, output_csv, num_groupings, features, header, mode, workers=1, window_packets=None,
+                 window_us=None, streams=None, tones=None):
+        """
+        :param features: window_values, the per packet values the window runs over
+        :param window_packets: window length in packets, WINDOW_PACKETS if neither it nor window_us is given
+        :param window_us: window length in microseconds of TSF
+        """
+        super().__init__(output_csv, num_groupings, features, header, mode, workers, streams, tones)
+        if window_packets is None and window_us is None:
+            window_packets = WINDOW_PACKETS
+        num_tones = NUM_TONES if self.num_tones is None else self.num_tones
+        self.stats = CSI_Stats.SlidingWindowStats((num_groupings, num_tones), window_packets, window_us)
+
+    def write(self, chunk, labels):
+        """
+        Add the rows of a chunk
+        :param chunk: PacketChunk
+        :param labels: victory label of every packet in the chunk
+        :return:
+        """
+        blocks = []
+        block_rows = []
+        for rows, data in chunk.groups.values():
+            if selected_shape(data, self.num_groupings, self.num_tones):
+                blocks.append(self.features(data, self.num_groupings, self.num_tones))
+                block_rows.append(rows)
+        if not blocks:
+            return
+        rows = np.concatenate(block_rows)
+        order = np.argsort(rows, kind="stable")
+        rows = rows[order]
+        stats = self.stats.extend(np.concatenate(blocks)[order], chunk.meta["tfs_stamp"][rows])
+        self.write_rows(np.column_stack([stats.reshape(len(rows), -1).astype(np.int64), labels[rows]]))
+
+
+class GrowableMemmap:
+    """
+    Row oriented np.memmap that grows by doubling its file as rows are appended.
+    Attributes:
+        file_name   (str):          file the rows are stored in
+        dtype       (numpy dtype):  type of the stored values
+        num_columns (int):          values per row, 0 for a 1-D array
+        num_rows    (int):          rows written so far
+    """
 
+    def __init__(self, file_name, dtype, num_columns=0, capacity=BLOCK_ROWS):
+        self.file_name = file_name
+        self.dtype = np.dtype(dtype)
+        self.num_columns = num_columns
+        self.num_rows = 0
+        self.capacity = 0
+        self.array = None
+        open(file_name, 'wb').close()
+        self.resize(capacity)
+
+    def row_shape(self, num_rows):
+        return (num_rows, self.num_columns) if self.num_columns else (num_rows,)
+
+    def resize(self, capacity):
+        """
+        Change the number of rows the file can hold and map it again
+        :param capacity: number of rows
+        :return:
+        """
+        if self.array is not None:
+            self.array.flush()
+            self.array = None
+        row_bytes = self.dtype.itemsize * max(self.num_columns, 1)
+        with open(self.file_name, 'r+b') as f:
+            f.truncate(capacity * row_bytes)
+        self.capacity = capacity
+        if capacity > 0:
+            self.array = np.memmap(self.file_name, dtype=self.dtype, mode='r+', shape=self.row_shape(capacity))
+
+    def append(self, rows):
+        """
+        Copy rows to the end of the array
+        :param rows: numpy array of rows
+        :return:
+        """
+        if self.num_rows + len(rows) > self.capacity:
+            self.resize(max(2 * self.capacity, self.num_rows + len(rows)))
+        self.array[self.num_rows:self.num_rows + len(rows)] = rows
+        self.num_rows += len(rows)
+
+    def close(self):
+        self.resize(self.num_rows)  # trim the unused capacity
+        self.array = None
+
+
+class BinarySink:
+    """
+    Sink of the compile pipeline that writes the feature matrix and the victory labels as typed binary arrays.
+    <output>.features holds a (rows, columns) array, <output>.labels a (rows,) int8 array and <output>.json describes
+    both, so they can be memory mapped with load_binary_dataset without any parsing.
+    Attributes:
+        output          (str):          base name of the output files
+        num_groupings   (int):          number of csi groups to include
+        features        (function):     mag_features or other_features
+        header          (function):     mag_header or other_header, gives the column names
+        dtype           (numpy dtype):  type of the feature values
+        streams         (numpy array):  indices of the streams to decode, None for all, see CsvSink
+        tones           (numpy array):  indices of the sub-carriers to decode, None for all
+        num_tones       (int):          number of selected tones, None without a tone selection
+    """
 
-def parse_and_data_compile_other(csi_log_file, num_groupings, bob_csv, eve_csv, output_csv):
+    def __init__(self, output, num_groupings, features, header, dtype, streams=None, tones=None):
+        self.output = output
+        self.num_groupings = num_groupings
+        self.features = features
+        self.header = header
+        self.dtype = np.dtype(dtype)
+        self.streams = streams
+        self.tones = tones
+        self.num_tones = None if tones is None else len(tones)
+        self.columns = header(num_groupings, self.num_tones).rstrip('\n').split(',')[:-1]
+        self.feature_array = None
+        self.label_array = None
+
+    def open(self):
+        self.feature_array = GrowableMemmap(self.output + ".features", self.dtype, len(self.columns))
+        self.label_array = GrowableMemmap(self.output + ".labels", np.int8)
+
+    def write(self, chunk, labels):
+        """
+        Add the rows of a chunk
+        :param chunk: PacketChunk
+        :param labels: victory label of every packet in the chunk
+        :return:
+        """
+        rows = packet_rows(chunk, labels, self.features, self.num_groupings, self.num_tones)
+        if rows is not None:
+            self.write_rows(rows)
+
+    def write_rows(self, rows):
+        """
+        Add rows that were already extracted, the label is the last column
+        :param rows: 2-D integer numpy array
+        :return:
+        """
+        self.feature_array.append(rows[:, :-1])
+        self.label_array.append(rows[:, -1])
+
+    @property
+    def num_rows(self):
+        return self.feature_array.num_rows
+
+    def close(self):
+        self.feature_array.close()
+        self.label_array.close()
+        header = {
+            "version": 1,
+            "rows": self.feature_array.num_rows,
+            "columns": self.columns,
+            "features": {
+                "file": os.path.basename(self.output + ".features"),
+                "dtype": self.dtype.str,
+                "shape": [self.feature_array.num_rows, len(self.columns)],
+            },
+            "labels": {
+                "file": os.path.basename(self.output + ".labels"),
+                "dtype": np.dtype(np.int8).str,
+                "shape": [self.label_array.num_rows],
+            },
+        }
+        with open(self.output + ".json", 'w') as f:
+            json.dump(header, f, indent=2)
+
+
+def load_binary_dataset(output):
     """
-    Open the CSI log file and both Bob and Eve csv files and parse them into a data csv file
+    Memory map a dataset written by BinarySink
+    :param output: base name of the output files
+    :return: (features memmap, labels memmap, header dict)
+    """
+    with open(output + ".json", 'r') as f:
+        header = json.load(f)
+    directory = os.path.dirname(output)
+    arrays = []
+    for name in ("features", "labels"):
+        info = header[name]
+        shape = tuple(info["shape"])
+        if shape[0] == 0:
+            arrays.append(np.empty(shape, dtype=info["dtype"]))
+        else:
+            arrays.append(np.memmap(os.path.join(directory, info["file"]), dtype=info["dtype"], mode='r', shape=shape))
+    return arrays[0], arrays[1], header
+
+
+def selected_shape(data, num_groupings, num_tones):
+    """
+    Whether the packets of a shape group get rows
+    :param data: complex numpy array of shape (packets, groups, tones)
+    :param num_groupings: number of csi groups to include
+    :param num_tones: number of selected tones, None without a tone selection
+    :return: True if the packets have num_groupings groups and every selected tone
+    """
+    return data.shape[1] == num_groupings and (num_tones is None or data.shape[2] == num_tones)
+
+
+def packet_rows(chunk, labels, features, num_groupings, num_tones=None):
+    """
+    Feature rows of every packet in a chunk that has num_groupings groups of CSI, in log order
+    :param chunk: PacketChunk
+    :param labels: victory label of every packet in the chunk
+    :param features: mag_features or other_features
+    :param num_groupings: number of csi groups to include
+    :param num_tones: number of selected tones, None without a tone selection
+    :return: 2-D integer numpy array with the label as the last column, or None if no packet matched
+    """
+    blocks = []
+    block_rows = []
+    for rows, data in chunk.groups.values():
+        if selected_shape(data, num_groupings, num_tones):
+            blocks.append(np.column_stack([features(data, num_groupings, num_tones), labels[rows]]))
+            block_rows.append(rows)
+    if not blocks:
+        return None
+    order = np.argsort(np.concatenate(block_rows), kind="stable")
+    return np.concatenate(blocks)[order]
+
+
+def checkpoint_file_name(output_csv):
+    """
+    Name of the checkpoint of an append compile
+    :param output_csv: output csv the compile appends to
+    :return: path of the checkpoint file
+    """
+    return output_csv + CHECKPOINT_SUFFIX
+
+
+def log_fingerprint(csi_log_file, offset):
+    """
+    Hash of the log bytes just before offset, tells a log that only grew from one that was rewritten in place
+    :param csi_log_file: log binary file that contains CSI info
+    :param offset: byte offset the compile got to
+    :return: hex digest
+    """
+    with open(csi_log_file, 'rb') as f:
+        f.seek(max(offset - CHECKPOINT_FINGERPRINT, 0))
+        return hashlib.sha1(f.read(min(offset, CHECKPOINT_FINGERPRINT))).hexdigest()
+
+
+def load_checkpoint(checkpoint, csi_log_file, output_csv):
+    """
+    Where the last append compile of a log into an output stopped
+    :param checkpoint: path of the checkpoint file
+    :param csi_log_file: log binary file that contains CSI info
+    :param output_csv: output csv the compile appends to
+    :return: dict with the offset, cursor and next_packet to resume at, None to start at the beginning of the log
+    """
+    try:
+        with open(checkpoint, 'r') as f:
+            saved = json.load(f)
+        output = saved["output"]
+        state = saved["logs"][os.path.abspath(csi_log_file)]
+        output_stat = os.stat(output_csv)
+        log_stat = os.stat(csi_log_file)
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+    # the output has to be exactly as the last checkpointed compile left it, the log the same file, unchanged or
+    # only grown since, e.g. while following a capture
+    if (output_stat.st_ino != output["inode"] or output_stat.st_size != output["size"]
+            or output_stat.st_mtime_ns != output["mtime_ns"]):
+        print("Output", output_csv, "changed since the checkpoint, compiling", csi_log_file, "from the beginning")
+        return None
+    if log_stat.st_size == state["log_size"]:
+        log_changed = log_stat.st_mtime_ns != state["log_mtime_ns"]
+    else:
+        log_changed = (log_stat.st_size < state["log_size"]
+                       or log_fingerprint(csi_log_file, state["offset"]) != state["fingerprint"])
+    if log_stat.st_ino != state["log_inode"] or log_changed:
+        print("Log", csi_log_file, "changed since the checkpoint, compiling it from the beginning")
+        return None
+    return state
+
+
+def save_checkpoint(checkpoint, csi_log_file, output_csv, offset, cursor, next_packet):
+    """
+    Record how far a log has been appended to an output, the checkpoint holds every log compiled into that output
+    :param checkpoint: path of the checkpoint file
+    :param csi_log_file: log binary file that contains CSI info
+    :param output_csv: output csv the compile appends to, already flushed
+    :param offset: byte offset of the first record that was not compiled
+    :param cursor: the original loops' cur at offset
+    :param next_packet: packet number of the first packet that was not compiled
+    :return:
+    """
+    try:
+        with open(checkpoint, 'r') as f:
+            logs = json.load(f)["logs"]
+    except (IOError, ValueError, KeyError, TypeError):
+        logs = {}
+    log_stat = os.stat(csi_log_file)
+    logs[os.path.abspath(csi_log_file)] = {
+        "offset": int(offset),
+        "cursor": int(cursor),
+        "next_packet": int(next_packet),
+        "log_size": log_stat.st_size,
+        "log_mtime_ns": log_stat.st_mtime_ns,
+        "log_inode": log_stat.st_ino,
+        "fingerprint": log_fingerprint(csi_log_file, offset),
+    }
+    output_stat = os.stat(output_csv)
+    output = {"size": output_stat.st_size, "mtime_ns": output_stat.st_mtime_ns, "inode": output_stat.st_ino}
+    tmp_file = checkpoint + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({"output": output, "logs": logs}, f, indent=2)
+    os.replace(tmp_file, checkpoint)
+
+
+def compile_log(csi_log_file, bob_csv, eve_csv, sink, chunk_size=CHUNK_SIZE, cache=None, checkpoint=None,
+                header_filter=None, start=None):
+    """
+    Stream the packets of a CSI log through a sink, memory stays constant no matter how big the log is
     :param csi_log_file: log binary file that contains CSI info
-    :param num_groupings: number of csi groups to include in output csv file
     :param bob_csv: csv file that contains the sequence numbers that bob collected
     :param eve_csv: csv file that contains the sequence numbers that eve collected
-    :param output_csv: output csv that data is written to
-    :return: nothing to return but check info in output csv
+    :param sink: object with open(), write(chunk, labels), close() and the streams and tones to decode, e.g. CsvSink
+    :param chunk_size: number of packets decoded in one batch
+    :param cache: CSI_Cache.CSICache, a cached log skips decoding and an uncached one is stored while compiling
+    :param checkpoint: checkpoint file of an appending CsvSink, the compile resumes where the last one stopped and
+                       records its progress after every chunk. The cache is not used then, it has no byte offsets
+    :param header_filter: dict for header_mask, packets it rejects are skipped before decoding. The cache is not
+                          used then either, it would only hold the packets that passed. Neither is it when the sink
+                          selects streams or tones
+    :param start: dict with the offset, cursor and next_packet to start at like load_checkpoint returns, for a
+                  caller that keeps the checkpoint itself. The cache is not used then either
+    :return: dict with the offset, cursor and next_packet the compile stopped at, they are None for a cached log
     """
 
     # try to open the file, if it fails exit the program
     try:
-        f = open(csi_log_file, "rb")
+        reader = CSI_Log_Reader.CSILogReader(csi_log_file)
     except IOError:
         print("Couldn't open file!")
         sys.exit()
 
-    # Open output csv and populate the headers
-    output = open(output_csv, 'w')
-    for i in range(num_groupings):
-        output.write("Average-" + str(i) + ",")
-    for i in range(num_groupings):
-        output.write("Variance-" + str(i) + ",")
-    for i in range(num_groupings):
-        output.write("Max-" + str(i) +",Min-" + str(i) + ",Range-" + str(i) + ",")
-    output.write("Victory\n")
-
-    # get the length of the entire file
-    len_of_file = os.stat(csi_log_file).st_size
+    sink.open()
     bob, eve = process_bob_eve(bob_csv, eve_csv)
-    num_packets = 1
-    cur = 0
-
-    # Init the binary to ascii objects
-    two_byte = struct.Struct("=H")
-    meta_struct = struct.Struct('=QHHBBBBBBBBBBBH')
-
-    while cur < (len_of_file - 4):  # loop until the end of the file is reached
-
-        # read all the meta data from the current
-        buf_len = two_byte.unpack(f.read(2))[0]
-
-        # Grab the meta from the binary file
-        meta_data = meta_struct.unpack(f.read(25))
-        # cur_csi_obj.tfs_stamp = meta_data[0]
-        # cur_csi_obj.csi_len = meta_data[1]
-        # cur_csi_obj.channel = meta_data[2]
-        # cur_csi_obj.phyerr = meta_data[3]
-        # cur_csi_obj.noise = meta_data[4]
-        # cur_csi_obj.rate = meta_data[5]
-        # cur_csi_obj.chan_bw = meta_data[6]
-        # cur_csi_obj.num_tones = meta_data[7]
-        # cur_csi_obj.nr = meta_data[8]
-        # cur_csi_obj.nc = meta_data[9]
-        # cur_csi_obj.rssi = meta_data[10]
-        # cur_csi_obj.rssi_0 = meta_data[11]
-        # cur_csi_obj.rssi_1 = meta_data[12]
-        # cur_csi_obj.rssi_2 = meta_data[13]
-        # cur_csi_obj.payload_len = meta_data[14]
-
-        cur += 53
-
-        # Check to see if there is any CSI data and if so read it from the file and put it on the output csv file
-        if meta_data[1] > 0:
-            csi_buff = bytearray(f.read(meta_data[1]))
-            data = CSI_Python_Parser.record_CSI_data(
-                csi_buff, meta_data[8], meta_data[9], meta_data[7], True
-            )
-            cur += meta_data[1]
-            if len(data) == num_groupings:
-                victory_score = bobVsEve(bob, eve, num_packets)
-                add_data_csv_other(data, output, num_groupings, victory_score)
-
-            num_packets += 1
-
-        # implement payload processing if needed, else just going to skip those bytes
-        cur += meta_data[14]
-        f.read(meta_data[14])
-
-
-        if cur + 420 > len_of_file:
-            break
-    output.close()
-    print("Finished parsing")
 
+    cached = cache_writer = None
+    if checkpoint is not None:
+        start = load_checkpoint(checkpoint, csi_log_file, sink.output_csv)
+    state = start or {"offset": 0, "cursor": 0, "next_packet": 1}
+    if checkpoint is not None or start is not None:
+        chunks = read_packet_chunks(reader, chunk_size, state["offset"], first_packet=state["next_packet"], cursor=state["cursor"],
+                                    header_filter=header_filter, streams=sink.streams, tones=sink.tones)
+    elif header_filter is not None or sink.streams is not None or sink.tones is not None:
+        chunks = read_packet_chunks(reader, chunk_size, header_filter=header_filter, streams=sink.streams, tones=sink.tones)
+    else:
+        cached = cache.load(csi_log_file) if cache is not None else None
+        cache_writer = cache.writer(csi_log_file) if cache is not None and cached is None else None
+        if cached is not None:
+            chunks = (PacketChunk(*parts) for parts in cached.chunks(chunk_size))
+        else:
+            chunks = read_packet_chunks(reader, chunk_size)
 
-def parse_and_data_compile_other_append(csi_log_file, num_groupings, bob_csv, eve_csv, output_csv):
+    try:
+        for chunk in chunks:
+            if cache_writer is not None:
+                cache_writer.add(chunk.packet_nums, chunk.meta, chunk.groups)
+            sink.write(chunk, victory_labels(bob, eve, chunk.packet_nums))
+            state = {"offset": chunk.end_offset, "cursor": chunk.end_cursor, "next_packet": chunk.next_packet}
+            if checkpoint is not None:
+                sink.flush()
+                save_checkpoint(checkpoint, csi_log_file, sink.output_csv, state["offset"], state["cursor"], state["next_packet"])
+        if cache_writer is not None:
+            cache_writer.commit()
+    except BaseException:
+        # also on Ctrl-C or sys.exit, a half written entry would stay in the cache directory for good
+        if cache_writer is not None:
+            cache_writer.abort()
+        raise
+
+    reader.close()
+    sink.close()
+    return state
+
+
+def follow_log(csi_log_file, bob_csv, eve_csv, sink, checkpoint=None, poll_interval=FOLLOW_INTERVAL, chunk_size=CHUNK_SIZE,
+               header_filter=None):
     """
-    Open the CSI log file and both Bob and Eve csv files and parse them into a data csv file
+    Tail a log that is still being captured, every poll compiles the complete records added since the last one.
+    Unlike compile_log the whole log is read up to its last complete record, not only up to where the original parse
+    loops stopped, and the bob and eve csvs are read again every poll because they may still be growing.
+    Runs until Ctrl-C, which is handled between chunks so the output and checkpoint always agree.
+    :param csi_log_file: log binary file that is being written by the capture
+    :param bob_csv: csv file that contains the sequence numbers that bob collected
+    :param eve_csv: csv file that contains the sequence numbers that eve collected
+    :param sink: CsvSink
+    :param checkpoint: checkpoint file to resume from and to keep up to date, None to start at the beginning of the log
+    :param poll_interval: seconds between polls
+    :param chunk_size: number of packets decoded in one batch
+    :param header_filter: dict for header_mask, packets it rejects are skipped before decoding
+    :return:
+    """
+    state = load_checkpoint(checkpoint, csi_log_file, sink.output_csv) if checkpoint is not None else None
+    state = state or {"offset": 0, "cursor": 0, "next_packet": 1}
+    stop = []
+    previous_handler = signal.signal(signal.SIGINT, lambda signum, frame: stop.append(signum))
+    sink.open()
+    try:
+        while not stop:
+            try:
+                bob, eve = process_bob_eve(bob_csv, eve_csv)
+                reader = CSI_Log_Reader.CSILogReader(csi_log_file)
+            except IOError:
+                reader = None  # the capture hasn't created its files yet
+            if reader is not None:
+                chunks = read_packet_chunks(reader, chunk_size, state["offset"], reader.size, state["next_packet"],
+                                            state["cursor"], header_filter, sink.streams, sink.tones)
+                for chunk in chunks:
+                    sink.write(chunk, victory_labels(bob, eve, chunk.packet_nums))
+                    sink.flush()
+                    state = {"offset": chunk.end_offset, "cursor": chunk.end_cursor, "next_packet": chunk.next_packet}
+                    if checkpoint is not None:
+                        save_checkpoint(checkpoint, csi_log_file, sink.output_csv, state["offset"], state["cursor"], state["next_packet"])
+                    if stop:
+                        break
+                reader.close()
+            if not stop:
+                time.sleep(poll_interval)
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        sink.close()
+    print("Stopped following", csi_log_file)
+
+
+def split_log(csi_log_file, num_ranges, start_offset=0):
+    """
+    Split a log into byte ranges on record boundaries, using its sidecar index
+    :param csi_log_file: log binary file that contains CSI info
+    :param num_ranges: number of ranges to aim for
+    :param start_offset: byte offset of the first record to include, e.g. from a checkpoint
+    :return: list of (start offset, end offset, packet number of the first packet in the range,
+             the original loops' cur at the end offset, packet number of the first packet after the range)
+    """
+    index = CSI_Log_Index.CSILogIndex(csi_log_file)
+    records = index.records[:index.legacy_count()]  # the records the serial compile reads
+    offsets = records["offset"].astype(np.int64)
+    first = int(np.searchsorted(offsets, start_offset))
+    if first == len(records):
+        return []
+    end = int(offsets[-1]) + CSI_Log_Reader.RECORD_HEADER_LEN + int(records["csi_len"][-1]) + int(records["payload_len"][-1])
+
+    # packet numbers count the records with CSI across the whole log, so every range knows where it starts
+    has_csi = records["csi_len"] > 0
+    first_packets = np.append(np.cumsum(has_csi) - has_csi + 1, np.count_nonzero(has_csi) + 1)
+    cursors = np.cumsum(CSI_Log_Reader.LEGACY_RECORD_LEN + records["csi_len"].astype(np.int64) + records["payload_len"])
+    splits = np.unique(np.searchsorted(offsets, np.linspace(offsets[first], end, num_ranges + 1)[1:-1]))
+    starts = np.concatenate([[first], splits[(splits > first) & (splits < len(offsets))]])
+    stops = np.append(starts[1:], len(offsets))
+    ends = list(offsets[starts[1:]]) + [end]
+    return [
+        (int(offsets[start]), int(stop_offset), int(first_packets[start]), int(cursors[stop - 1]), int(first_packets[stop]))
+        for start, stop, stop_offset in zip(starts, stops, ends)
+    ]
+
+
+def compile_range(csi_log_file, start, end, first_packet, bob, eve, features, num_groupings, as_text, chunk_size,
+                  header_filter=None, streams=None, tones=None):
+    """
+    Worker of compile_log_parallel, decode a byte range of the log and extract its rows
+    :param csi_log_file: log binary file that contains CSI info
+    :param start: byte offset of the first record
+    :param end: byte offset of the first record not to read
+    :param first_packet: packet number of the first packet in the range
+    :param bob: sorted array of sequence numbers bob collected
+    :param eve: sorted array of sequence numbers eve collected
+    :param features: mag_features or other_features
+    :param num_groupings: number of csi groups to include
+    :param as_text: return csv text instead of an array
+    :param chunk_size: number of packets decoded in one batch
+    :param header_filter: dict for header_mask, packets it rejects are skipped before decoding
+    :param streams: indices of the streams to decode, None for all
+    :param tones: indices of the sub-carriers to decode, None for all
+    :return: 2-D integer numpy array with the label as the last column, or its csv text
+    """
+    blocks = []
+    num_tones = None if tones is None else len(tones)
+    with CSI_Log_Reader.CSILogReader(csi_log_file) as reader:
+        for chunk in read_packet_chunks(reader, chunk_size, start, end, first_packet, None, header_filter, streams, tones):
+            rows = packet_rows(chunk, victory_labels(bob, eve, chunk.packet_nums), features, num_groupings, num_tones)
+            if rows is not None:
+                blocks.append(rows)
+    if not blocks:
+        return '' if as_text else None
+    rows = np.concatenate(blocks)
+    return format_rows(rows) if as_text else rows
+
+
+def compile_log_parallel(csi_log_file, bob_csv, eve_csv, sink, workers, chunk_size=CHUNK_SIZE, checkpoint=None,
+                         header_filter=None):
+    """
+    compile_log on a process pool, byte ranges of the log are compiled in parallel and merged in packet order
     :param csi_log_file: log binary file that contains CSI info
-    :param num_groupings: number of csi groups to include in output csv file
     :param bob_csv: csv file that contains the sequence numbers that bob collected
     :param eve_csv: csv file that contains the sequence numbers that eve collected
-    :param output_csv: output csv that data is written to
-    :return: nothing to return but check info in output csv
+    :param sink: CsvSink or BinarySink
+    :param workers: number of worker processes
+    :param chunk_size: number of packets decoded in one batch
+    :param checkpoint: checkpoint file of an appending CsvSink, see compile_log
+    :param header_filter: dict for header_mask, packets it rejects are skipped before decoding
+    :return:
     """
 
     # try to open the file, if it fails exit the program
     try:
-        f = open(csi_log_file, "rb")
+        state = load_checkpoint(checkpoint, csi_log_file, sink.output_csv) if checkpoint is not None else None
+        ranges = split_log(csi_log_file, workers * RANGES_PER_WORKER, state["offset"] if state else 0)
     except IOError:
         print("Couldn't open file!")
         sys.exit()
 
-    # Open output csv and populate the headers
-    output = open(output_csv, 'a')
-
-    # get the length of the entire file
-    len_of_file = os.stat(csi_log_file).st_size
+    sink.open()
     bob, eve = process_bob_eve(bob_csv, eve_csv)
-    num_packets = 1
-    cur = 0
-
-    # Init the binary to ascii objects
-    two_byte = struct.Struct("=H")
-    meta_struct = struct.Struct('=QHHBBBBBBBBBBBH')
-
-    while cur < (len_of_file - 4):  # loop until the end of the file is reached
-
-        # read all the meta data from the current
-        buf_len = two_byte.unpack(f.read(2))[0]
-
-        # Grab the meta from the binary file
-        meta_data = meta_struct.unpack(f.read(25))
-        # cur_csi_obj.tfs_stamp = meta_data[0]
-        # cur_csi_obj.csi_len = meta_data[1]
-        # cur_csi_obj.channel = meta_data[2]
-        # cur_csi_obj.phyerr = meta_data[3]
-        # cur_csi_obj.noise = meta_data[4]
-        # cur_csi_obj.rate = meta_data[5]
-        # cur_csi_obj.chan_bw = meta_data[6]
-        # cur_csi_obj.num_tones = meta_data[7]
-        # cur_csi_obj.nr = meta_data[8]
-        # cur_csi_obj.nc = meta_data[9]
-        # cur_csi_obj.rssi = meta_data[10]
-        # cur_csi_obj.rssi_0 = meta_data[11]
-        # cur_csi_obj.rssi_1 = meta_data[12]
-        # cur_csi_obj.rssi_2 = meta_data[13]
-        # cur_csi_obj.payload_len = meta_data[14]
-
-        cur += 53
-
-        # Check to see if there is any CSI data and if so read it from the file and put it on the output csv file
-        if meta_data[1] > 0:
-            csi_buff = bytearray(f.read(meta_data[1]))
-            data = CSI_Python_Parser.record_CSI_data(
-                csi_buff, meta_data[8], meta_data[9], meta_data[7], True
-            )
-            cur += meta_data[1]
-            if len(data) == num_groupings:
-                victory_score = bobVsEve(bob, eve, num_packets)
-                add_data_csv_other(data, output, num_groupings, victory_score)
-
-            num_packets += 1
+    as_text = isinstance(sink, CsvSink)  # csv rows are formatted by the workers too
 
-        # implement payload processing if needed, else just going to skip those bytes
-        cur += meta_data[14]
-        f.read(meta_data[14])
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(
+                compile_range, csi_log_file, start, end, first_packet, bob, eve,
+                sink.features, sink.num_groupings, as_text, chunk_size, header_filter, sink.streams, sink.tones
+            )
+            for start, end, first_packet, end_cursor, next_packet in ranges
+        ]
+        for future, (start, end, first_packet, end_cursor, next_packet) in zip(futures, ranges):  # in packet order
+            result = future.result()
+            if as_text:
+                sink.write_text(result)
+            elif result is not None:
+                sink.write_rows(result)
+            if checkpoint is not None:
+                sink.flush()
+                save_checkpoint(checkpoint, csi_log_file, sink.output_csv, end, end_cursor, next_packet)
+
+    sink.close()
+
+
+def make_sink(mode, num_groupings, output_csv, workers=1, window_packets=None, window_us=None, streams=None,
+              tones=None):
+    """
+    Build the sink of one of the compile modes
+    :param mode: compile mode, a key of COMPILE_MODES
+    :param num_groupings: number of csi groups to include in output csv file
+    :param output_csv: output csv that data is written to, base name of the output files for binary modes
+    :param workers: number of processes that format large blocks of csv rows
+    :param window_packets: window length in packets of mode 7
+    :param window_us: window length in microseconds of TSF of mode 7
+    :param streams: indices of the streams to decode, None for all
+    :param tones: indices of the sub-carriers to decode, None for all
+    :return: sink for compile_log
+    """
+    sink_class, features, header, option = COMPILE_MODES[mode]
+    if sink_class is BinarySink:
+        return BinarySink(output_csv, num_groupings, features, header, option, streams, tones)
+    if sink_class is WindowStatsSink:
+        return WindowStatsSink(output_csv, num_groupings, features, header, option, workers, window_packets, window_us,
+                               streams, tones)
+    return CsvSink(output_csv, num_groupings, features, header if option == 'w' else None, option, workers, streams,
+                   tones)
 
 
-        if cur + 420 > len_of_file:
-            break
-    output.close()
+def parse_and_data_compile_mag(csi_log_file, num_groupings, bob_csv, eve_csv, output_csv):
+    """
+    Open the CSI log file and both Bob and Eve csv files and parse them into a data csv file
+    :param csi_log_file: log binary file that contains CSI info
+    :param num_groupings: number of csi groups to include in output csv file
+    :param bob_csv: csv file that contains the sequence numbers that bob collected
+    :param eve_csv: csv file that contains the sequence numbers that eve collected
+    :param output_csv: output csv that data is written to
+    :return: nothing to return but check info in output csv
+    """
+    compile_log(csi_log_file, bob_csv, eve_csv, make_sink('1', num_groupings, output_csv))
     print("Finished parsing")
 
 
-def parse_and_data_compile_append(csi_log_file, num_groupings, bob_csv, eve_csv, output_csv):
+def parse_and_data_compile_other(csi_log_file, num_groupings, bob_csv, eve_csv, output_csv):
     """
     Open the CSI log file and both Bob and Eve csv files and parse them into a data csv file
     :param csi_log_file: log binary file that contains CSI info
@@ -341,113 +1001,188 @@ def parse_and_data_compile_append(csi_log_file, num_groupings, bob_csv, eve_csv,
     :param output_csv: output csv that data is written to
     :return: nothing to return but check info in output csv
     """
+    compile_log(csi_log_file, bob_csv, eve_csv, make_sink('2', num_groupings, output_csv))
+    print("Finished parsing")
 
-    # try to open the file, if it fails exit the program
-    try:
-        f = open(csi_log_file, "rb")
-    except IOError:
-        print("Couldn't open file!")
-        sys.exit()
-
-    # Open output csv and populate the headers
-    output = open(output_csv, 'a')
 
-    # get the length of the entire file
-    len_of_file = os.stat(csi_log_file).st_size
-    bob, eve = process_bob_eve(bob_csv, eve_csv)
-    num_packets = 1
-    cur = 0
-
-    # Init the binary to ascii objects
-    two_byte = struct.Struct("=H")
-    meta_struct = struct.Struct('=QHHBBBBBBBBBBBH')
-
-    while cur < (len_of_file - 4):  # loop until the end of the file is reached
-
-        # read all the meta data from the current
-        buf_len = two_byte.unpack(f.read(2))[0]
-
-        # Grab the meta from the binary file
-        meta_data = meta_struct.unpack(f.read(25))
-        # cur_csi_obj.tfs_stamp = meta_data[0]
-        # cur_csi_obj.csi_len = meta_data[1]
-        # cur_csi_obj.channel = meta_data[2]
-        # cur_csi_obj.phyerr = meta_data[3]
-        # cur_csi_obj.noise = meta_data[4]
-        # cur_csi_obj.rate = meta_data[5]
-        # cur_csi_obj.chan_bw = meta_data[6]
-        # cur_csi_obj.num_tones = meta_data[7]
-        # cur_csi_obj.nr = meta_data[8]
-        # cur_csi_obj.nc = meta_data[9]
-        # cur_csi_obj.rssi = meta_data[10]
-        # cur_csi_obj.rssi_0 = meta_data[11]
-        # cur_csi_obj.rssi_1 = meta_data[12]
-        # cur_csi_obj.rssi_2 = meta_data[13]
-        # cur_csi_obj.payload_len = meta_data[14]
-
-        cur += 53
-
-        # Check to see if there is any CSI data and if so read it from the file and put it on the output csv file
-        if meta_data[1] > 0:
-            csi_buff = bytearray(f.read(meta_data[1]))
-            data = CSI_Python_Parser.record_CSI_data(
-                csi_buff, meta_data[8], meta_data[9], meta_data[7], True
-            )
-            cur += meta_data[1]
-            if len(data) == num_groupings:
-                victory_score = bobVsEve(bob, eve, num_packets)
-                add_data_csv(data, output, num_groupings, victory_score)
+def parse_and_data_compile_other_append(csi_log_file, num_groupings, bob_csv, eve_csv, output_csv):
+    """
+    Open the CSI log file and both Bob and Eve csv files and parse them into a data csv file
+    :param csi_log_file: log binary file that contains CSI info
+    :param num_groupings: number of csi groups to include in output csv file
+    :param bob_csv: csv file that contains the sequence numbers that bob collected
+    :param eve_csv: csv file that contains the sequence numbers that eve collected
+    :param output_csv: output csv that data is written to
+    :return: nothing to return but check info in output csv
+    """
+    compile_log(csi_log_file, bob_csv, eve_csv, make_sink('4', num_groupings, output_csv),
+                checkpoint=checkpoint_file_name(output_csv))
+    print("Finished parsing")
 
-            num_packets += 1
 
-        # implement payload processing if needed, else just going to skip those bytes
-        cur += meta_data[14]
-        f.read(meta_data[14])
+def parse_and_data_compile_append(csi_log_file, num_groupings, bob_csv, eve_csv, output_csv):
+    """
+    Open the CSI log file and both Bob and Eve csv files and parse them into a data csv file
+    :param csi_log_file: log binary file that contains CSI info
+    :param num_groupings: number of csi groups to include in output csv file
+    :param bob_csv: csv file that contains the sequence numbers that bob collected
+    :param eve_csv: csv file that contains the sequence numbers that eve collected
+    :param output_csv: output csv that data is written to
+    :return: nothing to return but check info in output csv
+    """
+    compile_log(csi_log_file, bob_csv, eve_csv, make_sink('3', num_groupings, output_csv),
+                checkpoint=checkpoint_file_name(output_csv))
+    print("Finished parsing")
 
 
-        if cur + 420 > len_of_file:
-            break
-    output.close()
-    print("Finished parsing")
+def read_seq_csv(seq_csv):
+    """
+    Read the sequence numbers of a bob or eve csv into a sorted integer array
+    :param seq_csv: csv filled with sequence numbers in the first column
+    :return: sorted numpy array of the unique sequence numbers
+    """
+    seq_nums = []
+    with open(seq_csv, 'r') as f:
+        for row in csv.reader(f, delimiter=","):
+            # only exact decimal numbers ever matched a packet number, skip anything else like a header
+            if row and row[0].isdigit() and str(int(row[0])) == row[0]:
+                seq_nums.append(int(row[0]))
+    return np.unique(np.array(seq_nums, dtype=np.int64))
 
 
 def process_bob_eve(bob_csv, eve_csv):
     """
-    Create lists of packets received by bob and eve
+    Create sorted arrays of packets received by bob and eve
     :param bob_csv: csv filled with sequence numbers bob received
     :param eve_csv: csv filled with sequence numbers eve received
     """
-    bob_csv = open(bob_csv, 'r')
-    eve_csv = open(eve_csv, 'r')
-    bob_reader = csv.reader(bob_csv, delimiter=",")
-    eve_reader = csv.reader(eve_csv, delimiter=",")
+    return read_seq_csv(bob_csv), read_seq_csv(eve_csv)
+
+
+def seq_member(seq_array, seq_nums):
+    """
+    Vectorized membership test against a sorted array of sequence numbers
+    :param seq_array: sorted numpy array of sequence numbers
+    :param seq_nums: numpy array of sequence numbers to look up
+    :return: boolean numpy array, True where seq_nums is in seq_array
+    """
+    if len(seq_array) == 0:
+        return np.zeros(len(seq_nums), dtype=bool)
+    pos = np.searchsorted(seq_array, seq_nums)
+    pos[pos == len(seq_array)] = 0
+    return seq_array[pos] == seq_nums
 
-    bob_seq = []
-    eve_seq = []
-    for row in bob_reader:
-        bob_seq.append(row[0])
-    for row in eve_reader:
-        eve_seq.append(row[0])
-    return bob_seq, eve_seq
+
+def victory_labels(bob_array, eve_array, seq_nums):
+    """
+    Determine who the winner is between bob and eve for many packets at once
+    :param bob_array: sorted array of sequence numbers bob collected
+    :param eve_array: sorted array of sequence numbers eve collected
+    :param seq_nums: numpy array of packet numbers
+    :return: numpy array of max(bob - eve, 0) for every packet number
+    """
+    seq_nums = np.asarray(seq_nums, dtype=np.int64)
+    return (seq_member(bob_array, seq_nums) & ~seq_member(eve_array, seq_nums)).astype(np.int64)
 
 
 def bobVsEve(bob_array, eve_array, seq_num):
     """
     Determine who is the winner is between bob and eve
-    :param bob_array: list of sequence numbers bob collected
-    :param eve_array: list of sequence numbers eve collected
+    :param bob_array: sorted array of sequence numbers bob collected
+    :param eve_array: sorted array of sequence numbers eve collected
     :param seq_num: seq_num to see who won
     """
-    bob_value = 0
-    eve_value = 0
-    if str(seq_num) in bob_array:
-        bob_value = 1
-    if str(seq_num) in eve_array:
-        eve_value = 1
-    value = bob_value - eve_value
-    if value < 0:
-        value = 0
-    return value
+    return int(victory_labels(bob_array, eve_array, [seq_num])[0])
+
+
+def mag_header(num_groupings, num_tones=None):
+    """
+    Column names of the magnitude csv
+    :param num_groupings: number of groupings to include
+    :param num_tones: number of tones per grouping, None for NUM_TONES
+    :return: header line
+    """
+    num_tones = NUM_TONES if num_tones is None else num_tones
+    return ''.join([str(int(x / num_tones)) + '-' + str(x % num_tones) + ',' for x in range(num_tones * num_groupings)]) + 'Victory\n'
+
+
+def other_header(num_groupings, num_tones=None):
+    """
+    Column names of the statistical analysis csv
+    :param num_groupings: number of groupings to include
+    :param num_tones: number of tones the statistics cover, the columns don't depend on it
+    :return: header line
+    """
+    header = ["Average-" + str(i) + "," for i in range(num_groupings)]
+    header += ["Variance-" + str(i) + "," for i in range(num_groupings)]
+    header += ["Max-" + str(i) + ",Min-" + str(i) + ",Range-" + str(i) + "," for i in range(num_groupings)]
+    return ''.join(header) + "Victory\n"
+
+
+def window_header(num_groupings, num_tones=None):
+    """
+    Column names of the sliding window csv
+    :param num_groupings: number of groupings to include
+    :param num_tones: number of tones per grouping, None for NUM_TONES
+    :return: header line
+    """
+    num_tones = NUM_TONES if num_tones is None else num_tones
+    header = [name + "-" + str(int(x / num_tones)) + "-" + str(x % num_tones) + ","
+              for name in ("Mean", "Variance", "Max", "Min") for x in range(num_tones * num_groupings)]
+    return ''.join(header) + "Victory\n"
+
+
+def mag_features(data, num_groupings, num_tones=None):
+    """
+    Rounded magnitudes of the first tones of every group
+    :param data: complex numpy array of shape (packets, groups, tones)
+    :param num_groupings: number of groupings to include
+    :param num_tones: number of tones to include, None for NUM_TONES
+    :return: int64 numpy array of shape (packets, num_tones * num_groupings)
+    """
+    num_tones = NUM_TONES if num_tones is None else num_tones
+    mag = np.rint(np.abs(data[:, :num_groupings, :num_tones]))
+    return mag.astype(np.int64).reshape(len(data), -1)
+
+
+def other_features(data, num_groupings, num_tones=None):
+    """
+    Average, variance, max, min and range of the magnitudes of every group, truncated like int()
+    :param data: complex numpy array of shape (packets, groups, tones)
+    :param num_groupings: number of groupings to include
+    :param num_tones: number of tones the statistics cover, None for every tone
+    :return: int64 numpy array of shape (packets, 5 * num_groupings)
+    """
+    mag = np.abs(data[:, :num_groupings, :num_tones])
+    max_mag = np.amax(mag, axis=2)
+    min_mag = np.amin(mag, axis=2)
+    max_min_range = np.stack([max_mag, min_mag, max_mag - min_mag], axis=2).reshape(len(data), -1)
+    columns = [np.mean(mag, axis=2), np.var(mag, axis=2), max_min_range]
+    return np.concatenate(columns, axis=1).astype(np.int64)
+
+
+def window_values(data, num_groupings, num_tones=None):
+    """
+    Magnitudes of the first tones of every group, the values the sliding window of mode 7 runs over
+    :param data: complex numpy array of shape (packets, groups, tones)
+    :param num_groupings: number of groupings to include
+    :param num_tones: number of tones to include, None for NUM_TONES
+    :return: float numpy array of shape (packets, num_groupings, num_tones)
+    """
+    num_tones = NUM_TONES if num_tones is None else num_tones
+    return np.abs(data[:, :num_groupings, :num_tones])
+
+
+def format_rows(rows):
+    """
+    Format a block of integer rows as csv text in one go
+    :param rows: 2-D integer numpy array
+    :return: csv text with one line per row
+    """
+    if rows.size == 0:
+        return ''
+    line = ','.join(['%d'] * rows.shape[1]) + '\n'
+    return (line * rows.shape[0]) % tuple(rows.ravel().tolist())
 
 
 def add_data_csv(data, csv_file, num_groupings, victory_score):
@@ -459,10 +1194,8 @@ def add_data_csv(data, csv_file, num_groupings, victory_score):
     :param: victory_score: did bob or eve win
     :return:
     """
-    for j in range(num_groupings):
-        for k in range(56):
-            csv_file.write(str(int(round(np.abs(data[j][k])))) + ',')
-    csv_file.write(str(victory_score) + '\n')
+    features = mag_features(np.asarray(data)[np.newaxis], num_groupings)
+    csv_file.write(format_rows(np.column_stack([features, [victory_score]])))
 
 
 def add_data_csv_other(data, csv_file, num_groupings, victory_score):
@@ -474,23 +1207,8 @@ def add_data_csv_other(data, csv_file, num_groupings, victory_score):
     :param victory_score: who won the packet (bob or eve)
     :return:
     """
-    average_list = []
-    variance_list = []
-    max_list = []
-    min_list = []
-    for i in range(num_groupings):
-        mag = np.abs(data[i])
-        average_list.append(np.mean(mag))
-        variance_list.append(np.var(mag))
-        max_list.append(np.amax(mag))
-        min_list.append(np.amin(mag))
-    for i in range(num_groupings):
-        csv_file.write(str(int(average_list[i])) + ",")
-    for i in range(num_groupings):
-        csv_file.write(str(int(variance_list[i])) + ",")
-    for i in range(num_groupings):
-        csv_file.write(str(int(max_list[i])) + "," + str(int(min_list[i])) + "," + str(int(max_list[i]-min_list[i])) + ",")
-    csv_file.write(str(victory_score) + '\n')
+    features = other_features(np.asarray(data)[np.newaxis], num_groupings)
+    csv_file.write(format_rows(np.column_stack([features, [victory_score]])))
 
 
 def create_data_sheet(csi_obj_list, num_groupings, bob_csv, eve_csv, out_file):
@@ -505,42 +1223,97 @@ def create_data_sheet(csi_obj_list, num_groupings, bob_csv, eve_csv, out_file):
     """
     bob, eve = process_bob_eve(bob_csv, eve_csv)
     d_tree_file = open(out_file, 'w')
+    d_tree_file.write(mag_header(num_groupings).replace('Victory', 'victory'))
 
-    for x in range(56 * num_groupings):
-        d_tree_file.write(str(int(x / 56)) + '-' + str(x % 56) + ',')
-    d_tree_file.write('victory\n')
+    # packets with fewer groups are padded with zeros
+    rows = np.zeros((len(csi_obj_list), NUM_TONES * num_groupings + 1), dtype=np.int64)
     for i in range(len(csi_obj_list)):
-        for j in range(len(csi_obj_list[i].data) if len(csi_obj_list[i].data) < (num_groupings + 1) else num_groupings):
-            for k in range(56):
-                d_tree_file.write(str(int(round(np.abs(csi_obj_list[i].data[j][k])))) + ',')
-        if len(csi_obj_list[i].data) < num_groupings:
-            for j in range(num_groupings - len(csi_obj_list[i].data)):
-                for k in range(56):
-                    d_tree_file.write('0,')
-        d_tree_file.write(str(bobVsEve(bob, eve, i + 1)) + '\n')
+        if len(csi_obj_list[i].data) > 0:
+            features = mag_features(np.asarray(csi_obj_list[i].data)[np.newaxis], num_groupings)
+            rows[i, :features.shape[1]] = features[0]
+    rows[:, -1] = victory_labels(bob, eve, np.arange(1, len(csi_obj_list) + 1))
+
+    writer = CsvBlockWriter(d_tree_file)
+    writer.add(rows)
+    writer.close()
+    d_tree_file.close()
+
+
+# compile mode to (sink, feature extraction, header, output file mode or binary feature type)
+COMPILE_MODES = {
+    '1': (CsvSink, mag_features, mag_header, 'w'),
+    '2': (CsvSink, other_features, other_header, 'w'),
+    '3': (CsvSink, mag_features, mag_header, 'a'),
+    '4': (CsvSink, other_features, other_header, 'a'),
+    '5': (BinarySink, mag_features, mag_header, np.int16),
+    '6': (BinarySink, other_features, other_header, np.int32),
+    '7': (WindowStatsSink, window_values, window_header, 'w'),
+}
 
 
 def main():
-    if len(sys.argv) < 7:
-        print("python data_compile.py csi_log_file num_groupings bob_csv eve_csv output_csv mode")
+    args, options = CSI_Options.parse_options(
+        sys.argv[1:], dict({"workers": int, "cache": str, "cache-size": int, "follow": bool, "poll": float,
+                            "window": int, "window-us": int, "streams": CSI_Options.index_list, "tones": CSI_Options.index_list},
+                           **{name: int for name in FILTER_OPTIONS})
+    )
+    if options is None:
         return
-    if len(sys.argv) > 7:
+    if len(args) < 6:
+        print("python data_compile.py csi_log_file num_groupings bob_csv eve_csv output_csv mode [--workers N] "
+              "[--cache DIR [--cache-size MB]] [--follow [--poll SECONDS]] [--window PACKETS | --window-us US] "
+              "[--streams 0,1] [--tones 0-55]")
+        print("Packets can be filtered on their status header before decoding with "
+              + ' '.join("[--" + name + " N]" for name in FILTER_OPTIONS))
+        return
+    if len(args) > 6:
         print("To many arguments")
         return
-    if sys.argv[6] == '1':
-        parse_and_data_compile_mag(sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5])
-        print("Done")
-    elif sys.argv[6] == '2':
-        parse_and_data_compile_other(sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5])
-        print("Done")
-    elif sys.argv[6] == '3':
-        parse_and_data_compile_append(sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5])
-        print("Done")
-    elif sys.argv[6] == '4':
-        parse_and_data_compile_other_append(sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5])
+    if options.get("window", 1) <= 0 or options.get("window-us", 1) <= 0:
+        print("--window and --window-us have to be longer than 0")
+        return
+    if "window" in options and "window-us" in options:
+        print("Give either --window or --window-us")
+        return
+    if args[5] in COMPILE_MODES:
+        workers = options.get("workers", 1)
+        # a serial compile (cached, following or mode 7) still formats large blocks of rows on the workers
+        sink = make_sink(args[5], int(args[1]), args[4], workers, options.get("window"), options.get("window-us"),
+                         options.get("streams"), options.get("tones"))
+        if isinstance(sink, WindowStatsSink):
+            workers = 1  # the window has to see the packets in log order
+        cache = None
+        if "cache" in options:
+            size_limit = options.get("cache-size", CSI_Cache.DEFAULT_SIZE_LIMIT >> 20) << 20
+            cache = CSI_Cache.CSICache(options["cache"], size_limit)
+
+        # append modes resume where the last compile of the log into the same output stopped
+        checkpoint = checkpoint_file_name(args[4]) if COMPILE_MODES[args[5]][3] == 'a' else None
+        header_filter = header_filter_from_options(options)
+        if header_filter is not None or sink.streams is not None or sink.tones is not None:
+            cache = None  # the cache holds every packet decoded in full
+
+        if "follow" in options:
+            if checkpoint is None:
+                print("--follow needs an append mode (3 or 4)")
+                return
+            follow_log(args[0], args[2], args[3], sink, checkpoint, options.get("poll", FOLLOW_INTERVAL),
+                       header_filter=header_filter)
+        elif workers > 1 and (cache is None or checkpoint is not None):
+            compile_log_parallel(args[0], args[2], args[3], sink, workers, checkpoint=checkpoint,
+                                 header_filter=header_filter)
+        else:
+            # a cached log is compiled serially, decoding was the part worth spreading over workers. The workers
+            # don't hand their decoded packets back, so a log missing from the cache is filled by a serial compile
+            if workers > 1 and cache.load(args[0]) is None:
+                print("Filling the cache with", args[0] + ", compiling it serially this time")
+            compile_log(args[0], args[2], args[3], sink, cache=cache, checkpoint=checkpoint,
+                        header_filter=header_filter)
+        print("Finished parsing")
         print("Done")
     else:
-        print("Wrong type of mode was provided. Mode 1 is magnitude and Mode 2 is statistical analysis")
+        print("Wrong type of mode was provided. Mode 1 is magnitude and Mode 2 is statistical analysis, "
+              "3 and 4 append them, 5 and 6 write them as binary arrays, 7 is sliding window statistics")
 
 
 if __name__ == "__main__":